@@ -0,0 +1,492 @@
+'''
+Offline benchmark of the conversational form engine.
+
+Drives full PizzaOrder and UserRegistration conversations through
+CBaseModel.start / CBaseModel.dialogue with a fake cat (deterministic stub LLM,
+hashing stub embedder, in-memory qdrant and in-memory settings), for each
+json_extractor and for strict and non strict mode.
+
+Per turn it reports wall time, LLM calls, embedding calls, prompt characters
+and peak memory, and compares the totals with a stored baseline. The batched
+scenario runs 16 concurrent PizzaOrder sessions whose extraction prompts are
+micro-batched to a stub backend (the LLM calls count the batch requests).
+
+    python benchmarks/bench_cform.py                  # run and compare with benchmarks/baseline.json
+    python benchmarks/bench_cform.py --save-baseline  # run and save the baseline
+    python benchmarks/bench_cform.py --extractor kor --strict
+'''
+import argparse
+import contextlib
+import hashlib
+import io
+import importlib
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from enum import Enum
+from typing import Any, List, Optional
+
+PLUGIN_DIR    = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+EXTRACTORS    = ["langchain", "kor", "guardrails", "from examples", "fused", "field examples"]
+
+
+###################################
+######## FAKE CAT FRAMEWORK #######
+###################################
+
+HOOKS = {}
+
+# Decorator usable with or without arguments
+def _decorator(register=None):
+    def decorator(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            if register:
+                register(args[0])
+            return args[0]
+        def wrapper(fn):
+            if register:
+                register(fn)
+            return fn
+        return wrapper
+    return decorator
+
+# Install the cat modules imported by the plugin
+def install_fake_cat():
+    modules = {name: types.ModuleType(name) for name in [
+        "cat", "cat.mad_hatter", "cat.mad_hatter.decorators", "cat.log", "cat.looking_glass", "cat.looking_glass.prompts"
+    ]}
+    modules["cat.mad_hatter.decorators"].hook   = _decorator(lambda fn: HOOKS.setdefault(fn.__name__, []).append(fn))
+    modules["cat.mad_hatter.decorators"].tool   = _decorator()
+    modules["cat.mad_hatter.decorators"].plugin = _decorator()
+    modules["cat.log"].log = logging.getLogger("cat")
+    modules["cat.looking_glass.prompts"].MAIN_PROMPT_PREFIX = "You are the Cheshire Cat AI."
+    modules["cat.looking_glass.prompts"].MAIN_PROMPT_SUFFIX = "# Context\n\n{episodic_memory}\n\n## Conversation until now:{chat_history}\n - Human: {input}\n - AI: "
+    sys.modules.update(modules)
+
+# Import the plugin modules as a package
+def import_plugin():
+    package = types.ModuleType("cat_form")
+    package.__path__ = [PLUGIN_DIR]
+    sys.modules["cat_form"] = package
+    return {
+        "cform":    importlib.import_module("cat_form.cform"),
+        "settings": importlib.import_module("cat_form.settings"),
+        "pizza":    importlib.import_module("cat_form.cat_form_order_pizza"),
+        "register": importlib.import_module("cat_form.cat_form_user_registration"),
+    }
+
+
+###########################
+######## SCENARIOS ########
+###########################
+
+# Conversations: (user message, fields the LLM extracts, intent)
+CONVERSATIONS = {
+    "PizzaOrder": [
+        ("I want to order a pizza",           {},                                   "none"),
+        ("I would like a Margherita pizza",   {"pizza_type": "Margherita"},         "none"),
+        ("I live in Via Roma 1",              {"address": "Via Roma 1"},            "none"),
+        ("my number is 08234453",             {"phone": "08234453"},                "none"),
+        ("yes, they are correct",             {},                                   "confirm"),
+    ],
+    "UserRegistration": [
+        ("I would like to register",          {},                                   "none"),
+        ("My name is Mario Rossi",            {"name": "Mario", "surname": "Rossi"}, "none"),
+        ("I work at Acme",                    {"company": "Acme"},                  "none"),
+        ("my email is mario@acme.com",        {"email": "mario@acme.com"},          "none"),
+        ("ok, they are fine",                 {},                                   "confirm"),
+    ]
+}
+
+
+#########################
+######## STUBS ##########
+#########################
+
+# Benchmark counters
+class Counters():
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.llm_calls = 0
+        self.prompt_chars = 0
+        self.embedding_calls = 0
+        self.embedded_texts = 0
+
+
+def build_stubs(counters):
+    from langchain.llms.base import LLM
+    from langchain.embeddings.base import Embeddings
+
+    # Deterministic stub LLM (answers from the conversation script)
+    class StubLLM(LLM):
+        script: Any = None
+
+        @property
+        def _llm_type(self):
+            return "stub"
+
+        def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> str:
+            counters.llm_calls += 1
+            counters.prompt_chars += len(prompt)
+            fields, intent, model_name = self.script()
+
+            if "Identify the language" in prompt:
+                return "English"
+            if "'YES' or 'NO'" in prompt:
+                return "YES" if intent == "confirm" else "NO"
+            if '"intent"' in prompt and '"reply"' in prompt:
+                return json.dumps({"updates": fields, "intent": intent, "reply": "Could you give me the missing data?"})
+            if "extract structured information" in prompt:
+                return f"<json>{json.dumps({model_name.lower(): [fields]})}</json>"
+            if "JSON" in prompt or "json" in prompt or "Updated Model" in prompt:
+                return json.dumps(fields)
+            return "Could you give me the missing data?"
+
+    # Hashing stub embedder (bag of character trigrams)
+    class HashingEmbedder(Embeddings):
+        size: int = 256
+
+        def _embed(self, text):
+            vector = [0.0] * self.size
+            text = f"  {text.lower()}  "
+            for i in range(len(text) - 2):
+                vector[int(hashlib.md5(text[i:i + 3].encode()).hexdigest(), 16) % self.size] += 1.0
+            norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+            return [x / norm for x in vector]
+
+        def embed_documents(self, texts):
+            counters.embedding_calls += 1
+            counters.embedded_texts += len(texts)
+            return [self._embed(text) for text in texts]
+
+        def embed_query(self, text):
+            return self.embed_documents([text])[0]
+
+    return StubLLM, HashingEmbedder
+
+
+# In-memory plugin (settings store)
+class FakePlugin():
+    path = None
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def load_settings(self):
+        return dict(self.settings)
+
+
+class FakeMadHatter():
+    def __init__(self, plugin):
+        self.plugin = plugin
+
+    def get_plugin(self):
+        return self.plugin
+
+    def execute_hook(self, name, value, cat):
+        for fn in HOOKS.get(name, []):
+            value = fn(value, cat)
+        return value
+
+
+class FakeWorkingMemory(dict):
+    pass
+
+
+class FakeCat():
+    def __init__(self, llm, embedder, vector_db, settings):
+        self._llm = llm
+        self.embedder = embedder
+        self.memory = types.SimpleNamespace(vectors=types.SimpleNamespace(vector_db=vector_db))
+        self.mad_hatter = FakeMadHatter(FakePlugin(settings))
+        self.working_memory = FakeWorkingMemory()
+        self.user_id = "bench"
+
+    def llm(self, prompt, stream=False):
+        return self._llm(prompt)
+
+    def send_ws_message(self, content, msg_type="notification"):
+        pass
+
+
+#######################
+######## RUNNER #######
+#######################
+
+# Default settings from the plugin settings schema
+def default_settings(settings_module):
+    settings = {}
+    for name, field in settings_module.MySettings.model_fields.items():
+        value = field.default
+        settings[name] = value.value if isinstance(value, Enum) else value
+    return settings
+
+
+# Run the bootstrap hook (compiles the forms and publishes the intent collections)
+def bootstrap(plugin, stubs, vector_db):
+    StubLLM, HashingEmbedder = stubs
+    cat = FakeCat(StubLLM(script=lambda: ({}, "none", "")), HashingEmbedder(), vector_db, default_settings(plugin["settings"]))
+    for fn in HOOKS.get("after_cat_bootstrap", []):
+        fn(cat)
+
+
+# Run one turn of a conversation
+def run_turn(model_class, form_class, cat, message, i, strict):
+    if i == 0:
+        response = model_class.start(cat, form=form_class)
+    else:
+        response = model_class.dialogue({}, cat)
+        response = response["output"] if response else None
+
+    # Non strict mode: the agent answers with the form prompt prefix
+    if response is None and model_class.get(cat) is not None and not strict:
+        prefix = cat.mad_hatter.execute_hook("agent_prompt_prefix", "You are the Cheshire Cat AI.", cat=cat)
+        response = cat.llm(f"{prefix}\n\nHuman: {message}\nAI:")
+
+    # The reply is sent
+    for fn in HOOKS.get("before_cat_sends_message", []):
+        fn({"content": response}, cat)
+    return response
+
+
+# Run one conversation, return the per-turn metrics
+def run_conversation(plugin, model_name, extractor, strict, counters, stubs, vector_db, measure_memory):
+    StubLLM, HashingEmbedder = stubs
+    model_class = {"PizzaOrder": plugin["pizza"].PizzaOrder, "UserRegistration": plugin["register"].UserRegistration}[model_name]
+    form_class  = plugin["pizza"].MyForm if model_name == "PizzaOrder" else plugin["cform"].CForm
+
+    settings = default_settings(plugin["settings"])
+    settings.update({"json_extractor": extractor, "strict": strict, "stream_response": False})
+    if model_name == "PizzaOrder":
+        examples_path = os.path.join(PLUGIN_DIR, "saved_settings", "example-pizza.json")
+        with open(examples_path) as f:
+            settings["pizza_order_examples"] = f.read()
+
+    conversation = CONVERSATIONS[model_name]
+    state = {"turn": 0}
+
+    def script():
+        _, fields, intent = conversation[state["turn"]]
+        return fields, intent, model_name
+
+    cat = FakeCat(StubLLM(script=script), HashingEmbedder(), vector_db, settings)
+
+    turns = []
+    for i, (message, _, _) in enumerate(conversation):
+        state["turn"] = i
+        cat.working_memory["user_message_json"] = {"text": message}
+        counters.reset()
+        if measure_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        error = None
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = run_turn(model_class, form_class, cat, message, i, strict)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        wall = time.perf_counter() - start
+        peak = 0
+        if measure_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        turns.append({
+            "message":         message,
+            "wall_ms":         round(wall * 1000, 3),
+            "llm_calls":       counters.llm_calls,
+            "embedding_calls": counters.embedding_calls,
+            "embedded_texts":  counters.embedded_texts,
+            "prompt_chars":    counters.prompt_chars,
+            "peak_kb":         round(peak / 1024, 1),
+            "error":           error
+        })
+    return turns
+
+
+# Run the PizzaOrder conversation in concurrent sessions with the batch extraction
+# (the sessions share one llm whose extraction prompts go to a StubBatchBackend with a fixed latency per request;
+# return the per-turn metrics summed over the sessions and the batcher stats)
+def run_batched_conversations(plugin, counters, stubs, vector_db, sessions=16, latency=0.005):
+    batching = importlib.import_module("cat_form.cform_batching")
+    StubLLM, HashingEmbedder = stubs
+    model_class, form_class = plugin["pizza"].PizzaOrder, plugin["pizza"].MyForm
+
+    settings = default_settings(plugin["settings"])
+    settings.update({"json_extractor": "from examples", "strict": True, "stream_response": False, "batch_extraction": True})
+    with open(os.path.join(PLUGIN_DIR, "saved_settings", "example-pizza.json")) as f:
+        settings["pizza_order_examples"] = f.read()
+
+    conversation = CONVERSATIONS["PizzaOrder"]
+    local = threading.local()
+    llm = StubLLM(script=lambda: conversation[local.turn][1:] + ("PizzaOrder",))
+
+    # The batch backend answers the extraction prompts with the fields of the latest message they contain
+    def extract(prompt):
+        message, fields, _ = max(conversation, key=lambda turn: prompt.rfind(turn[0]))
+        return json.dumps(fields)
+    backend = batching.StubBatchBackend(extract, latency=latency)
+    batching.register_batch_backend(llm, backend)
+    batcher = batching.extraction_batcher
+    batcher.counters = {"batches": 0, "prompts": 0, "errors": 0}
+
+    turns = []
+    barrier = threading.Barrier(sessions)
+    for i, (message, _, _) in enumerate(conversation):
+        counters.reset()
+        errors = []
+
+        def session(n):
+            local.turn = i
+            cat = cats[n]
+            cat.working_memory["user_message_json"] = {"text": message}
+            barrier.wait()
+            try:
+                run_turn(model_class, form_class, cat, message, i, True)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+
+        if i == 0:
+            cats = [FakeCat(llm, HashingEmbedder(), vector_db, settings) for _ in range(sessions)]
+            for n, cat in enumerate(cats):
+                cat.user_id = f"bench-{n}"
+
+        requests_before = len(backend.batch_sizes)
+        start = time.perf_counter()
+        threads = [threading.Thread(target=session, args=(n,)) for n in range(sessions)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        turns.append({
+            "message":         message,
+            "wall_ms":         round((time.perf_counter() - start) * 1000, 3),
+            "llm_calls":       counters.llm_calls + len(backend.batch_sizes) - requests_before,
+            "embedding_calls": counters.embedding_calls,
+            "embedded_texts":  counters.embedded_texts,
+            "prompt_chars":    counters.prompt_chars,
+            "peak_kb":         0.0,
+            "error":           "; ".join(errors) or None
+        })
+    return turns, batcher.stats()
+
+
+# Sum the per-turn metrics
+def totals(turns):
+    keys = ["wall_ms", "llm_calls", "embedding_calls", "embedded_texts", "prompt_chars"]
+    result = {key: round(sum(turn[key] for turn in turns), 3) for key in keys}
+    result["peak_kb"] = max(turn["peak_kb"] for turn in turns)
+    result["errors"] = sum(1 for turn in turns if turn["error"])
+    return result
+
+
+# Compare the results with the baseline, return the regressions
+# (any error is a regression: a failing turn makes fewer calls and would look like an improvement;
+# wall time is noisy: it has its own tolerance and differences under 5 ms are ignored)
+def compare(results, baseline, tolerance, time_tolerance):
+    regressions = []
+    for scenario, result in results.items():
+        if result["totals"]["errors"]:
+            errors = [turn["error"] for turn in result["turns"] if turn["error"]]
+            regressions.append(f"{scenario} errors: {result['totals']['errors']} ({errors[0]})")
+        if scenario not in baseline:
+            continue
+        for key in ["llm_calls", "embedding_calls", "prompt_chars", "wall_ms"]:
+            old, new = baseline[scenario]["totals"][key], result["totals"][key]
+            allowed = time_tolerance if key == "wall_ms" else tolerance
+            if key == "wall_ms" and new - old < 5:
+                continue
+            if old and (new - old) / old > allowed:
+                regressions.append(f"{scenario} {key}: {old} -> {new} (+{(new - old) / old:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the conversational form engine")
+    parser.add_argument("--model", choices=list(CONVERSATIONS.keys()), action="append")
+    parser.add_argument("--extractor", choices=EXTRACTORS, action="append")
+    parser.add_argument("--strict", action="store_true", help="run only strict mode")
+    parser.add_argument("--non-strict", action="store_true", help="run only non strict mode")
+    parser.add_argument("--no-memory", action="store_true", help="do not trace the peak memory (faster)")
+    parser.add_argument("--no-batching", action="store_true", help="do not run the concurrent batch extraction sessions")
+    parser.add_argument("--verbose", action="store_true", help="print the metrics of every turn")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression of the counters")
+    parser.add_argument("--time-tolerance", type=float, default=0.50, help="allowed relative regression of the wall time")
+    args = parser.parse_args()
+
+    logging.getLogger("cat").setLevel(logging.CRITICAL + 1)
+    install_fake_cat()
+    plugin = import_plugin()
+
+    from qdrant_client import QdrantClient
+    counters  = Counters()
+    stubs     = build_stubs(counters)
+    vector_db = QdrantClient(":memory:")
+    bootstrap(plugin, stubs, vector_db)
+
+    modes = [True, False]
+    if args.strict:
+        modes = [True]
+    if args.non_strict:
+        modes = [False]
+
+    results = {}
+    for model_name in args.model or CONVERSATIONS.keys():
+        for extractor in args.extractor or EXTRACTORS:
+            for strict in modes:
+                scenario = f"{model_name}/{extractor}/{'strict' if strict else 'non-strict'}"
+                turns = run_conversation(plugin, model_name, extractor, strict, counters, stubs, vector_db, not args.no_memory)
+                results[scenario] = {"turns": turns, "totals": totals(turns)}
+
+    # Concurrent sessions with the batch extraction
+    if "PizzaOrder" in (args.model or CONVERSATIONS.keys()) and not args.no_batching:
+        turns, batch_stats = run_batched_conversations(plugin, counters, stubs, vector_db)
+        results["PizzaOrder/from examples/batched x16"] = {"turns": turns, "totals": totals(turns)}
+        print(f"batch extraction: {batch_stats['batches']} requests for {batch_stats['prompts']} prompts, "
+              f"fill rate {batch_stats['fill_rate']:.0%}\n")
+
+    # Report
+    header = f"{'scenario':<48}{'wall ms':>10}{'llm':>6}{'emb':>6}{'texts':>7}{'prompt ch':>11}{'peak kb':>10}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for scenario, result in results.items():
+        t = result["totals"]
+        print(f"{scenario:<48}{t['wall_ms']:>10.1f}{t['llm_calls']:>6}{t['embedding_calls']:>6}{t['embedded_texts']:>7}"
+              f"{t['prompt_chars']:>11}{t['peak_kb']:>10.1f}{t['errors']:>8}")
+        if args.verbose:
+            for turn in result["turns"]:
+                print(f"    {turn['message'][:42]:<44}{turn['wall_ms']:>10.1f}{turn['llm_calls']:>6}{turn['embedding_calls']:>6}"
+                      f"{turn['embedded_texts']:>7}{turn['prompt_chars']:>11}{turn['peak_kb']:>10.1f}  {turn['error'] or ''}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.time_tolerance)
+        print(f"\nCompared with {args.baseline}: {len(regressions)} regressions")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,29 @@
 from cat.mad_hatter.decorators import tool, hook
 from pydantic import Field, field_validator
 from cat.log import log
-from typing import Dict
-from .cform import CForm, CBaseModel
-import json
+from typing import Dict, Annotated
+from .cform import CForm, CBaseModel, get_json_setting, Regex, Lookup
 import random
+import re
 
 menu = [ "Margherita", "Romana", "Quattro Formaggi", "Capricciosa", "Bufalina", "Diavola"]
     
 
 # Declare model class
 class PizzaOrder(CBaseModel):
+
+    # Fast router examples
+    start_examples = [
+        "I would like to order a pizza",
+        "I'll take a Margherita pizza"
+    ]
+    stop_examples = [
+        "I don't want to order pizza anymore",
+        "I want to give up on the order",
+        "go back to normal conversation"
+    ]
     
-    pizza_type: str = Field(
+    pizza_type: Annotated[str, Lookup(menu)] = Field(
         #default = None,
         description = "The type of pizza",
         examples = [
@@ -28,7 +39,7 @@ class PizzaOrder(CBaseModel):
             ("I live in Corso Italia 34", "Corso Italia 34")
         ])
     
-    phone: str = Field(
+    phone: Annotated[str, Regex(r"\+?\d[\d \-]{6,}\d", normalize=lambda phone: re.sub(r"[ \-]", "", phone))] = Field(
         #default = None,
         description = "The user's telephone number",
         examples = [
@@ -47,8 +58,7 @@ class PizzaOrder(CBaseModel):
         return
 
     def examples(self, cat):
-        settings = cat.mad_hatter.get_plugin().load_settings()
-        return json.loads(settings["pizza_order_examples"])
+        return get_json_setting(cat, "pizza_order_examples")
 
     def execute_action(self, cat):
         result = "<h3>PIZZA CHALLENGE - ORDER COMPLETED<h3><br>" 
@@ -75,9 +85,9 @@ class PizzaOrder(CBaseModel):
 
 # Extend CForm class
 class MyForm(CForm):
-    def __init__(self, model_class, key, cat):
+    def __init__(self, model_class, key, cat, session=None):
         print("MyForm constructor")
-        super().__init__(model_class, key, cat)
+        super().__init__(model_class, key, cat, session=session)
     
     def check_user_confirm(self) -> bool:
         print("MyForm check_user_confirm")
@@ -95,6 +105,8 @@ class MyForm(CForm):
         print("MyForm model_validate")
         return super().model_validate(model)
     
+# Use MyForm when the fast router starts the order
+PizzaOrder.form_class = MyForm
 
 
 # Order pizza start intent
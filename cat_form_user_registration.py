@@ -1,21 +1,28 @@
 from cat.mad_hatter.decorators import tool, hook
 from pydantic import Field, field_validator
 from cat.log import log
-from typing import Dict
-from .cform import CForm, CBaseModel
-import json
+from typing import Dict, Annotated
+from .cform import CForm, CBaseModel, get_json_setting, Regex
 
 
 class UserRegistration(CBaseModel):
+
+    # Fast router examples
+    start_examples = [
+        "I would register the user for the service",
+        "I want to sign up"
+    ]
+    stop_examples = [
+        "I don't want to continue this user registration"
+    ]
     
     name:    str = Field(description="Name of the user who wants to register")
     surname: str = Field(description="Surname of the user who wants to register")
     company: str = Field(description="Company where the user who wants to register works")
-    email:   str = Field(description="Email of the user who wants to register")
+    email:   Annotated[str, Regex(r"[\w.+\-]+@[\w\-]+(\.[\w\-]+)+")] = Field(description="Email of the user who wants to register")
 
     def examples(self, cat):
-        settings = cat.mad_hatter.get_plugin().load_settings()
-        return json.loads(settings["user_registration_examples"])
+        return get_json_setting(cat, "user_registration_examples")
     
     def execute_action(self, cat):
         result = "<h3>You have registered<h3><br>" 
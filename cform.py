@@ -1,22 +1,34 @@
-from pydantic import ValidationError, BaseModel
+from pydantic import BaseModel
 from cat.mad_hatter.decorators import hook
 from cat.looking_glass.prompts import MAIN_PROMPT_PREFIX, MAIN_PROMPT_SUFFIX
 from cat.log import log
-from typing import Dict
+from typing import Dict, List, ClassVar, Optional
 from enum import Enum
 import json
-
-from qdrant_client.http.models import Distance, VectorParams, PointStruct
-
-from langchain.prompts.prompt import PromptTemplate
-from langchain.output_parsers import PydanticOutputParser
-import guardrails as gd #https://www.guardrailsai.com/docs/guardrails_ai/getting_started
-from kor import create_extraction_chain, from_pydantic #https://github.com/eyurtsev/kor
-
-from langchain.prompts.few_shot import FewShotPromptTemplate
-from langchain.prompts.prompt import PromptTemplate
-from langchain.prompts.example_selector import SemanticSimilarityExampleSelector
-from langchain.vectorstores import Qdrant
+import re
+
+from .cform_embedder import get_cached_embedder
+from .cform_settings import SettingsSnapshot, get_settings, get_json_setting
+from .cform_language import get_language_detector, language_name, language_code
+from .cform_confirm import get_confirm_classifier, same_negations
+from .cform_compiled import CompiledForms
+from .cform_executor import TurnExecutor
+from .cform_turn import TurnContext
+from .cform_extractors import FieldExtractor, Regex, Lookup, Custom, extract_fields
+from .cform_field_examples import FieldExampleIndexes
+from .cform_stream import llm_stream
+from .cform_trace import tracer
+from .cform_session import FormSession, FormRegistry, registry_name
+from .cform_machinery import FormMachineries
+from .cform_store import SessionStore, SessionStores
+from .cform_router import FormRouter
+from .cform_result_cache import result_cache
+from .cform_intents import IntentCollections, INTENT_COLLECTION, intent_examples, search_intents, vote
+from .cform_batching import extraction_batcher, get_batch_backend
+from .cform_prompts import (
+    LANGUAGE_PROMPT, CONFIRM_PROMPT, UPDATE_FROM_EXAMPLES_PROMPT, UPDATE_QUERY_PROMPT, FUSED_PROMPT,
+    ASK_MISSING_PROMPT, SHOW_SUMMARY_PROMPT, ASK_CHANGE_PROMPT, DIALOGUE_PROMPT
+)
 
 
 # Conversational Form State
@@ -28,79 +40,197 @@ class CFormState(Enum):
 
 
 # Class Conversational Form
+# (a facade over the form session stored in working memory and the machinery shared by the form class)
 class CForm():
 
-    def __init__(self, model_class, key, cat):
-        self.state = CFormState.INVALID
+    def __init__(self, model_class, key, cat, session=None):
         self.model_class = model_class
-        self.model = model_class.model_construct()
         self.key   = key
         self.cat   = cat
-        
-        self.is_valid = False
-        self.errors  = []
-        self.ask_for = []
+
+        # Session (a new one if the form is starting)
+        if session is None:
+            session = FormSession(registry_name(model_class), registry_name(type(self)), state=CFormState.INVALID.value)
+        self.session = session
+        self._model = None
+        self._model_values = None
+        self.dirty_fields = None
+
+        # Embedder with cache
+        settings = get_settings(self.cat)
+        self.embedder = get_cached_embedder(cat, settings)
+
+        # Machinery shared by all the sessions of the form class
+        self.machinery = FormMachineries.get(model_class, cat, self.embedder, settings)
 
         self.prompt_tpl_update   = None
         self.prompt_tpl_response = None
         self.load_dialog_examples_by_rag()
-        self.load_confirm_examples_by_rag()
-        self.load_exit_intent_examples_by_rag()
+        self.load_intent_examples_by_rag()
         
-        self.language = self.get_language()
+        if self.session.language is None:
+            self.language = self.get_language()
+
+    # Register the CForm subclasses (to resume their sessions)
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        FormRegistry.register_form(cls)
+
+
+    ###############################
+    ######## SESSION STATE ########
+    ###############################
+
+    # Form state
+    @property
+    def state(self):
+        return CFormState(self.session.state)
+
+    @state.setter
+    def state(self, state):
+        self.session.state = state.value
+
+    # Form model (built from the session values)
+    @property
+    def model(self):
+        if self._model is None or self._model_values is not self.session.values:
+            self._model = self.model_class.model_construct(**self.session.values)
+            self._model_values = self.session.values
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self.session.values = model.model_dump()
+        self._model = model
+        self._model_values = self.session.values
+
+    # Missing fields
+    @property
+    def ask_for(self):
+        return self.session.ask_for
+
+    @ask_for.setter
+    def ask_for(self, ask_for):
+        self.session.ask_for = ask_for
+
+    # Validation error messages
+    @property
+    def errors(self):
+        return list(self.session.errors.values())
+
+    @errors.setter
+    def errors(self, errors):
+        if not isinstance(errors, dict):
+            errors = {str(i): error for i, error in enumerate(errors)}
+        self.session.errors = errors
+
+    # Validation errors by field
+    @property
+    def field_errors(self):
+        return self.session.errors
+
+    # Language name
+    @property
+    def language(self):
+        return language_name(self.session.language)
+
+    @language.setter
+    def language(self, language):
+        self.session.language = language_code(language)
+
+    # Language code
+    @property
+    def language_code(self):
+        return self.session.language
+
+    @language_code.setter
+    def language_code(self, code):
+        self.session.language = code
 
 
     ####################################
     ######## HANDLE ACTIVE FORM ########
     ####################################
 
+    # Get the form of a session
+    # (the facade is built once per user message; None if the model class is no longer registered)
+    @classmethod
+    def from_session(cls, cat, key, session):
+        context = TurnContext.current(cat)
+        cform = context.values.get(("form", key))
+        if cform is not None and cform.session is session:
+            return cform
+
+        model_class = FormRegistry.model(session.model)
+        if model_class is None:
+            log.warning(f"Unable to resume form {key}: model class {session.model} not found")
+            return None
+        form_class = FormRegistry.form(session.form) or cls
+
+        cform = form_class(model_class, key, cat, session=session)
+        context.set(("form", key), cform)
+        return cform
+
     # Check that there is only one active form
     def check_active_form(self):
-        if "_active_cforms" not in self.cat.working_memory.keys():
-            self.cat.working_memory["_active_cforms"] = []
-        if self.key not in self.cat.working_memory["_active_cforms"]:
-            self.cat.working_memory["_active_cforms"].append(self.key)
-        for key in self.cat.working_memory["_active_cforms"]:
+        for key in list(SessionStores.sessions(self.cat).keys()):
             if key != self.key:
-                self.cat.working_memory["_active_cforms"].remove(key)
-                if key in self.cat.working_memory.keys():
-                    del self.cat.working_memory[key]
+                SessionStores.delete(self.cat, key)
 
     # Class method get active form
+    # (the most recently saved session of the user)
     @classmethod
     def get_active_form(cls, cat):
-        if "_active_cforms" in cat.working_memory.keys():
-            key = cat.working_memory["_active_cforms"][0]
-            if key in cat.working_memory.keys():
-                cform = cat.working_memory[key]
-                return cform
+        sessions = SessionStores.sessions(cat)
+        if sessions:
+            key = next(reversed(sessions))
+            return cls.from_session(cat, key, sessions[key])
         return None
 
+    # Save the session in the session store (unless the form has been closed)
+    def save(self):
+        if self.key in SessionStores.sessions(self.cat):
+            SessionStores.save(self.cat, self.key, self.session)
+
+    # Close the form (remove the session from the session store)
+    def close(self):
+        SessionStores.delete(self.cat, self.key)
+
 
     ##########################
     ######## LANGUAGE ########
     ##########################
 
     # Get language
+    # (detected locally, the LLM is queried only if the detector is not confident)
     def get_language(self):
 
+        # Language already detected for this user
+        if "_cform_language" in self.cat.working_memory.keys():
+            self.language_code = self.cat.working_memory["_cform_language"]
+            return language_name(self.language_code)
+
         # Get user message
         user_message = self.cat.working_memory["user_message_json"]["text"]
 
-        # Prompt
-        language_prompt = f"Identify the language of the following message \
-        and return only the language of the message, without other text.\n\
-        If you can't locate it, return 'English'.\n\
-        Message examples:\n\
-        'Ciao, come stai?', returns: 'Italian',\n\
-        'How do you go?', returns 'English',\n\
-        'Bonjour a tous', returns 'French'\n\n\
-        Message: '{user_message}'"
-        
-        # Queries the LLM and check if user is agree or not
-        response = self.cat.llm(language_prompt)
-        log.critical(f'Language: {response}')
-        return response
+        # Detect language
+        code, confidence = get_language_detector().detect(user_message)
+        log.debug(f"Language detected: {code} (confidence: {confidence})")
+
+        settings = get_settings(self.cat)
+        if confidence < settings.get("language_confidence_threshold", 0.8):
+
+            # Prompt
+            language_prompt = self.render_prompt(LANGUAGE_PROMPT, user_message=user_message)
+
+            # Queries the LLM (the result is cached for the message text)
+            response = self.cached_result("language", lambda: self.llm(language_prompt), semantic=False)
+            code = language_code(response) or code or "en"
+
+        self.language_code = code
+        self.cat.working_memory["_cform_language"] = code
+        log.debug(f'Language: {language_name(code)}')
+        return language_name(code)
     
 
     ####################################
@@ -110,173 +240,130 @@ class CForm():
     # Check user confirm the form data
     def check_user_confirm(self) -> bool:
         
+        # In fused mode the confirm classification comes with the fused turn result
+        settings = get_settings(self.cat)
+        if settings["json_extractor"] == "fused":
+            result = self.fused_turn()
+            if result is not None:
+                return result["intent"] == "confirm"
+
+        # The clear confirms and refusals are classified by the lexicon
+        confirm = self.check_user_confirm_lexical()
+        if confirm is not None:
+            return confirm
+
         # Decides whether to use rag for user confirmation
-        settings = self.cat.mad_hatter.get_plugin().load_settings()
-        if settings["use_rag_confirm"] is True:
-            return self.check_user_confirm_rag()
+        # (the result is cached for the message text and the similar messages)
+        if settings["use_rag_confirm"] is True and self.intent_collection is not None:
+            return self.cached_result(
+                "confirm rag", self.check_user_confirm_rag, guard=same_negations, variant=self.rag_variant("confirm")
+            )
+        return self.cached_result("confirm", self.check_user_confirm_llm, guard=same_negations)
+
+
+    # Check user confirm the form data by the confirm lexicon (None if the message is ambiguous)
+    def check_user_confirm_lexical(self):
+        settings = get_settings(self.cat)
+        classifier = get_confirm_classifier(settings["confirm_lexicon"])
+        confirm = classifier.classify(self.cat.working_memory["user_message_json"]["text"], self.language_code)
+        if confirm is not None:
+            tracer.count(lexical_confirms=1)
+            log.debug(f"check_user_confirm_lexical: {confirm}")
+        return confirm
+
+
+    # Check user confirm the form data by the LLM
+    def check_user_confirm_llm(self) -> bool:
 
         # Get user message
         user_message = self.cat.working_memory["user_message_json"]["text"]
         
         # Confirm prompt
-        confirm_prompt = f"Given a sentence that I will now give you,\n\
-        just respond with 'YES' or 'NO' depending on whether the sentence is:\n\
-        - a refusal either has a negative meaning or is an intention to cancel the form (NO)\n\
-        - an acceptance has a positive or neutral meaning (YES).\n\
-        If you are unsure, answer 'NO'.\n\n\
-        The sentence is as follows:\n\
-        User message: {user_message}"
-        
-        # Print confirm prompt
-        print("*"*10)
-        print("CONFIRM PROMPT:")
-        print(confirm_prompt)
-        print("*"*10)
+        confirm_prompt = self.render_prompt(CONFIRM_PROMPT, user_message=user_message)
 
         # Queries the LLM and check if user is agree or not
-        response = self.cat.llm(confirm_prompt)
-        log.critical(f'check_user_confirm: {response}')
+        response = self.llm(confirm_prompt)
         confirm = "NO" not in response and "YES" in response
-        
-        print("RESPONSE: " + str(confirm))
+        log.debug(f'check_user_confirm: {response} -> {confirm}')
         return confirm
     
 
-    # Load confirm examples by RAG
-    def load_confirm_examples_by_rag(self):
-        
-        qclient = self.cat.memory.vectors.vector_db
-        self.confirm_collection = "user_confirm"
-        
-        # Get embedder size
-        embedder_size = len(self.cat.embedder.embed_query("hello world"))
-
-        # Create collection
-        qclient.recreate_collection(
-            collection_name=self.confirm_collection,
-            vectors_config=VectorParams(
-                size=embedder_size, 
-                distance=Distance.COSINE
-            )
-        )
-
-        # Load context
-        examples = [ 
-            {"message": "yes, they are correct",   "label": "True" },
-            {"message": "ok, they are fine",       "label": "True" },
-            {"message": "they seem right",         "label": "True" },
-            {"message": "I think so",              "label": "True" },
-            {"message": "no, we are not there",    "label": "False"},
-            {"message": "wrong",                   "label": "False"},
-            {"message": "they are not correct",    "label": "False"},
-            {"message": "I don't think so",        "label": "False"}
-        ]
-
-        # Insert training data into index
-        points = []
-        for i, data in enumerate(examples):
-            message = data["message"]
-            label = data["label"]
-            vector = self.cat.embedder.embed_query(message)
-            points.append(PointStruct(id=i, vector=vector, payload={"label":label}))
-            
-        operation_info = qclient.upsert(
-            collection_name=self.confirm_collection,
-            wait=True,
-            points=points,
-        )
-        #print(operation_info)
-
-
     # Check if user confirm the model data in RAG mode
+    # (k nearest confirm examples vote)
     def check_user_confirm_rag(self) -> bool:
-        
-        # Get user message vector
-        user_message = self.cat.working_memory["user_message_json"]["text"]
-        user_message_vector = self.cat.embedder.embed_query(user_message)
-        
-        # Search for the vector most similar to the user message in the vector database
-        qclient = self.cat.memory.vectors.vector_db
-        search_results = qclient.search(
-            self.confirm_collection, 
-            user_message_vector, 
-            with_payload=True, 
-            limit=1
-        )
-        print(f"search_results: {search_results}")
-        most_similar_label = search_results[0].payload["label"]
-        
-        # If the nearest distance is less than the threshold, exit intent
-        return most_similar_label == "True"
+        settings = get_settings(self.cat)
+        search_results = self.intent_search_results("confirm")
+        log.debug(f"confirm search results: {search_results}")
+        return vote(search_results, settings["rag_confirm_threshold"]) == "True"
     
 
     ###################################
     ######## CHECK EXIT INTENT ########
     ###################################
 
-    # Load exit intent examples
-    def load_exit_intent_examples_by_rag(self):
-        
-        qclient = self.cat.memory.vectors.vector_db
-        self.exit_intent_collection = "exit_intent"
-        
-        # Get embedder size
-        embedder_size = len(self.cat.embedder.embed_query("hello world"))
-
-        # Create collection
-        qclient.recreate_collection(
-            collection_name=self.exit_intent_collection,
-            vectors_config=VectorParams(
-                size=embedder_size, 
-                distance=Distance.COSINE
-            )
-        )
-        
-        # Load context
-        examples = [ 
-            {"message": "I would like to exit the module"                   },
-            {"message": "I no longer want to continue filling out the form" },
-            {"message": "You go out"                                        },
-            {"message": "Return to normal conversation"                     },
-            {"message": "Stop and go out"                                   }
-        ]
-
-        # Insert training data into index
-        points = []
-        for i, data in enumerate(examples):
-            message = data["message"]
-            vector = self.cat.embedder.embed_query(message)
-            points.append(PointStruct(id=i, vector=vector, payload={}))
-            
-        operation_info = qclient.upsert(
-            collection_name=self.exit_intent_collection,
-            wait=True,
-            points=points,
-        )
-        #print(operation_info)
+    # Load the intent examples (confirm and exit)
+    def load_intent_examples_by_rag(self):
+        self.intent_collection = self.machinery.intent_collection
 
 
     # Check if the user wants to exit the intent
+    # (the result is cached for the message text, only while the intent collection is published)
     def check_exit_intent_rag(self) -> bool:
-        
-        # Get user message vector
-        user_message = self.cat.working_memory["user_message_json"]["text"]
-        user_message_vector = self.cat.embedder.embed_query(user_message)
-        
-        # Search for the vector most similar to the user message in the vector database and get distance
+        if self.intent_collection is None:
+            return self._check_exit_intent_rag()
+        return self.cached_result("exit", self._check_exit_intent_rag, semantic=False, variant=self.rag_variant("exit"))
+
+
+    # Search the exit intent examples (k nearest exit and continue examples vote)
+    def _check_exit_intent_rag(self) -> bool:
+        settings = get_settings(self.cat)
+        search_results = self.intent_search_results("exit")
+        log.debug(f"exit intent search results: {search_results}")
+        return vote(search_results, settings["rag_exit_threshold"]) == "True"
+
+
+    # Get the data a rag intent decision depends on (published examples, neighbours and threshold)
+    def rag_variant(self, intent):
+        settings = get_settings(self.cat)
         qclient = self.cat.memory.vectors.vector_db
-        search_results = qclient.search(
-            self.exit_intent_collection, 
-            user_message_vector, 
-            with_payload=False, 
-            limit=1
+        return (
+            IntentCollections.published_fingerprint(qclient, self.intent_collection),
+            settings[f"rag_{intent}_k"],
+            settings[f"rag_{intent}_threshold"]
+        )
+
+
+    # Get the intents searched in this turn (the confirm examples only while waiting for the confirm)
+    def rag_intents(self):
+        settings = get_settings(self.cat)
+        if self.state == CFormState.WAIT_CONFIRM and settings["use_rag_confirm"] is True:
+            return ["exit", "confirm"]
+        return ["exit"]
+
+
+    # Get the nearest examples of an intent
+    # (the intents of the turn are searched once, with a single embedding and a single batched request;
+    # none before the intent collection is published)
+    def intent_search_results(self, intent):
+        if self.intent_collection is None:
+            return []
+        context = TurnContext.current(self.cat)
+        results = context.get(("intent_search", self.intent_collection), lambda: self.search_intents(self.rag_intents()))
+        if intent not in results:
+            results = context.get(("intent_search", self.intent_collection, intent), lambda: self.search_intents([intent]))
+        return results[intent]
+
+
+    # Search the nearest examples of the intents
+    def search_intents(self, intents):
+        settings = get_settings(self.cat)
+        tracer.count(vector_searches=1)
+        return search_intents(
+            self.cat.memory.vectors.vector_db,
+            self.intent_collection,
+            self.user_message_vector(),
+            {intent: settings[f"rag_{intent}_k"] for intent in intents}
         )
-        print(f"search_results: {search_results}")
-        nearest_score = search_results[0].score
-        
-        # If the nearest score is less than the threshold, exit intent
-        threshold = 0.9
-        return nearest_score >= threshold
 
 
     ####################################
@@ -288,36 +375,50 @@ class CForm():
     def update(self):
 
         # User message to json details
-        json_details = self.user_message_to_json()
+        json_details = self.turn_result("extraction", self.user_message_to_json)
         if json_details is None:
             return False
         
         # model merge with details
-        print("json_details", json_details)
-        new_model = self.model_merge(json_details)
-        print("new_model", new_model)
+        with tracer.span("merge", form=self.key):
+            new_model = self.model_merge(json_details)
+        log.debug(f"json details: {json_details} -> new model: {new_model}")
         
         # Check if there is no information in the new_model that can update the form
-        if new_model == self.model.model_dump():
+        if not self.dirty_fields:
             return False
 
         # Validate new_details
-        self.model_validate(new_model)
+        with tracer.span("validation", form=self.key) as span:
+            self.model_validate(new_model)
+            span.set(ask_for=len(self.ask_for), errors=len(self.errors))
                     
         # If there are errors, return false
         if len(self.errors) > 0:
             return False
 
         # Overrides the current model with the new_model
-        self.model = self.model.model_construct(**new_model)
+        self.session.values = new_model
 
-        log.critical(f'MODEL : {self.model.model_dump()}')
+        log.debug(f'model: {self.model.model_dump()}')
         return True
 
 
     # User message to json
     def user_message_to_json(self): 
-        settings = self.cat.mad_hatter.get_plugin().load_settings()
+        settings = get_settings(self.cat)
+        tracer.set(extractor=settings["json_extractor"])
+
+        # Extract json detail with the deterministic field extractors
+        local_details = self._extract_info_locally()
+
+        # If they resolve exactly the fields asked for, skip the LLM
+        # (only while collecting the missing fields: an update can change any field)
+        if local_details and settings["json_extractor"] != "fused" and self.state == CFormState.INVALID:
+            if self.ask_for and set(local_details.keys()) == set(self.ask_for):
+                log.debug(f"local extraction: {local_details}")
+                tracer.set(extractor="local")
+                return local_details
 
         # Extract json detail from user message, based on the json_extractor setting
 
@@ -333,64 +434,100 @@ class CForm():
         if settings["json_extractor"] == "from examples":
             json_details = self._extract_info_from_examples_by_rag()
 
+        if settings["json_extractor"] == "fused":
+            json_details = self._extract_info_by_fused()
+
+        if settings["json_extractor"] == "field examples":
+            json_details = self._extract_info_from_field_examples()
+
+        # The deterministic values fill only the fields the LLM left empty
+        if local_details:
+            json_details = dict(json_details or {})
+            for key, value in local_details.items():
+                if json_details.get(key) in [None, ""]:
+                    json_details[key] = value
+
         return json_details
 
 
     # Model merge (actual model + details = new model)
+    # (the fields whose value changes are kept in dirty_fields)
     def model_merge(self, json_details):
         # Clean json details
         json_details = {key: value for key, value in json_details.items() if value not in [None, '', 'None', 'null', 'lower-case']}
 
         # update form
-        new_model = self.model.model_dump() | json_details
+        values = self.session.values
+        new_model = values | json_details
         
         # Clean json new_details
         new_model = {key: value for key, value in new_model.items() if value not in [None]}        
+
+        self.dirty_fields = [key for key, value in new_model.items() if key not in values or values[key] != value]
         return new_model
 
 
     # Validate model
+    # (only the dirty fields and the fields that depend on them, the other values are already valid)
     def model_validate(self, model):
-        self.ask_for = []
-        self.errors  = []
+        validator = CompiledForms.get(self.model_class).field_validator
+        self.ask_for, self.errors, valid = validator.validate(model, self.dirty_fields)
 
-        # Reset state to INVALID
-        self.state = CFormState.INVALID
-                
-        try:
-            # Pydantic model validate
-            self.model.model_validate(model)
-
-            # If model is valid change state to VALID
-            self.state = CFormState.VALID
-
-        except ValidationError as e:
-            
-            # Collect ask_for and errors messages
-            for error_message in e.errors():
-                if error_message['type'] == 'missing':
-                    self.ask_for.append(error_message['loc'][0])
-                else:
-                    self.errors.append(error_message["msg"])
+        # Change state to VALID or INVALID
+        self.state = CFormState.VALID if valid else CFormState.INVALID
 
 
     #############################################
     ############ USER MESSAGE TO JSON ###########
     #############################################
 
+    # Fields to extract from the user message (None for all the fields)
+    # (the missing and invalid fields and the fields mentioned in the message;
+    # in UPDATE state the fields mentioned in the message)
+    def extraction_fields(self):
+        compiled = CompiledForms.get(self.model_class)
+        user_message = self.cat.working_memory["user_message_json"]["text"].lower()
+        words = set(re.findall(r"[^\W\d_]{3,}", user_message))
+        mentioned = [key for key, keywords in compiled.field_keywords.items() if keywords & words]
+
+        if self.state in [CFormState.UPDATE]:
+            fields = mentioned
+        elif self.ask_for or self.field_errors:
+            fields = [*self.ask_for, *self.field_errors.keys(), *mentioned]
+        else:
+            return None
+
+        fields = [key for key in self.model_class.model_fields.keys() if key in fields]
+        if not fields or len(fields) == len(self.model_class.model_fields):
+            return None
+        return fields
+
+
+    # Get the compiled form of the fields to extract
+    def extraction_form(self):
+        fields = self.extraction_fields()
+        tracer.set(extraction_fields=len(fields) if fields else "all")
+        return CompiledForms.get(self.model_class, fields)
+
+
+    # Extracted new informations from the user's response (by the deterministic field extractors)
+    def _extract_info_locally(self):
+        extractors = CompiledForms.get(self.model_class).field_extractors
+        if not extractors:
+            return {}
+        user_message = self.cat.working_memory["user_message_json"]["text"]
+        return extract_fields(extractors, user_message)
+
+
     # Extracted new informations from the user's response (by pydantic langchain - pydantic library)
-    def _extract_info_by_langchain(self):
-        parser = PydanticOutputParser(pydantic_object=type(self.model))
-        prompt = PromptTemplate(
-            template="Answer the user query.\n{format_instructions}\n{query}\n",
-            input_variables=["query"],
-            partial_variables={"format_instructions": parser.get_format_instructions()},
-        )
-        log.debug(f'get_format_instructions: {parser.get_format_instructions()}')
+    # (compiled is the form of the fields to extract, by default the extraction form)
+    def _extract_info_by_langchain(self, compiled=None):
+        compiled = compiled or self.extraction_form()
+        log.debug(f'get_format_instructions: {compiled.format_instructions}')
         
         user_message = self.cat.working_memory["user_message_json"]["text"]
-        _input = prompt.format_prompt(query=user_message)
-        output = self.cat.llm(_input.to_string())
+        _input = compiled.langchain_prompt.format_prompt(query=user_message)
+        output = self.extraction_llm(_input.to_string())
         log.debug(f"output: {output}")
 
         user_response_json = json.loads(output)
@@ -404,16 +541,11 @@ class CForm():
         # Get user message
         user_message = self.cat.working_memory["user_message_json"]["text"]
         
-        # Get schema and validator from Pydantic model
-        schema, validator = from_pydantic(self.model_class)   
-        chain = create_extraction_chain(
-            self.cat._llm, 
-            schema, 
-            encoder_or_encoder_class="json", 
-            validator=validator
-        )
+        # Get chain from the compiled schema and validator
+        chain = self.extraction_form().kor_chain(self.cat._llm)
         log.debug(f"prompt: {chain.prompt.to_string(user_message)}")
         
+        tracer.count(llm_calls=1)
         output = chain.run(user_message)["validated_data"]
         try:
             user_response_json = output.dict()
@@ -430,24 +562,16 @@ class CForm():
         # Get user message
         user_message = self.cat.working_memory["user_message_json"]["text"]
         
-        # Prompt
-        prompt = """
-        Given the following client message, please extract information about his form.
-
-        ${message}
-
-        ${gr.complete_json_suffix_v2}
-        """
-        
         # Parse message
-        guard = gd.Guard.from_pydantic(output_class=self.model_class, prompt=prompt)
+        guard = self.extraction_form().guard
+        tracer.count(llm_calls=1)
         gd_result = guard(self.cat._llm, prompt_params={"message": user_message})
-        print(f'gd_result: {gd_result}')
+        log.debug(f'gd_result: {gd_result}')
 
         # If result is valid, return result
         if gd_result.validation_passed is True:
             result = json.loads(gd_result.raw_llm_output)
-            print(f'_extract_info: {user_message} -> {result}')
+            log.debug(f'_extract_info: {user_message} -> {result}')
             return result
         
         return {}
@@ -456,25 +580,103 @@ class CForm():
     def _extract_info_from_examples_by_rag(self):
         user_message = self.cat.working_memory["user_message_json"]["text"]
         
-        prompt = "Update the following JSON with information extracted from the Sentence:\n\n"
-        
+        # Only the fields to extract (or the whole model), in compact json
+        values = self.model.model_dump()
+        fields = self.extraction_fields()
+        if fields is not None:
+            values = {field: values.get(field) for field in fields}
+        model_json = json.dumps(values, separators=(",", ":"), default=str)
+
         if self.prompt_tpl_update:
-            prompt += self.prompt_tpl_update.format(
-                user_message = user_message, 
-                model = self.model.model_dump_json()
-            )
+            examples, query = self.few_shot(self.prompt_tpl_update, user_message=user_message, model=model_json)
         else:
-            prompt += f"\
-                Sentence: {user_message}\n\
-                JSON:{json.dumps(self.model.dict(), indent=4)}\n\
-                Updated JSON:"
+            examples, query = [], UPDATE_QUERY_PROMPT.template.format(user_message=user_message, model=model_json)
+        prompt = self.render_prompt(UPDATE_FROM_EXAMPLES_PROMPT, examples=examples, query=query)
             
-        json_str = self.cat.llm(prompt)
-        print(f"json after parser: {json_str}")
+        json_str = self.extraction_llm(prompt)
+        log.debug(f"json after parser: {json_str}")
         user_response_json = json.loads(json_str)
         return user_response_json
     
     
+    # Extracted new informations from the user's response (from the Field examples, by nearest neighbour)
+    # (a matching example template explains the whole message, otherwise the LLM is queried)
+    def _extract_info_from_field_examples(self):
+        user_message = self.cat.working_memory["user_message_json"]["text"]
+        settings = get_settings(self.cat)
+
+        index = FieldExampleIndexes.get(self.model_class, self.embedder)
+        details = index.match(user_message, self.user_message_vector(), settings["field_examples_threshold"])
+
+        # The LLM extracts only the fields the examples could not resolve
+        fields = self.extraction_fields() or list(self.model_class.model_fields.keys())
+        remaining = [field for field in fields if field not in details]
+        if not remaining:
+            tracer.set(extraction_fields=0)
+            return details
+        if len(remaining) == len(self.model_class.model_fields):
+            remaining = None
+        tracer.set(extraction_fields=len(remaining) if remaining else "all")
+
+        llm_details = self._extract_info_by_langchain(CompiledForms.get(self.model_class, remaining))
+        return (llm_details or {}) | details
+
+
+    # Extracted new informations from the user's response (from the fused turn result)
+    def _extract_info_by_fused(self):
+        result = self.fused_turn()
+        if result is None:
+            return None
+        return result["updates"]
+
+
+    # Extract the field updates, classify the user intent and generate the reply with a single LLM call
+    # (the result is computed once per user message)
+    def fused_turn(self):
+        return TurnContext.current(self.cat).get(("fused", self.key), lambda: self.run_phase("fused", self._fused_turn))
+
+
+    # Query the LLM for the fused turn result
+    def _fused_turn(self):
+        user_message = self.cat.working_memory["user_message_json"]["text"]
+
+        # Describe what the form is waiting for
+        if self.state in [CFormState.WAIT_CONFIRM]:
+            formatted_state = "you have shown the user the collected data and asked them to confirm that it is correct"
+        elif self.state in [CFormState.UPDATE]:
+            formatted_state = "the user said the data is not correct, you are waiting for the updated data"
+        else:
+            formatted_state = "you are collecting the data"
+
+        # Fused prompt
+        fused_prompt = self.render_prompt(
+            FUSED_PROMPT,
+            fields       = CompiledForms.get(self.model_class).formatted_field_descriptions,
+            model        = self.model.model_dump(),
+            state        = formatted_state,
+            language     = self.language,
+            user_message = user_message
+        )
+
+        # Queries the LLM
+        response = self.llm(fused_prompt)
+        log.debug(f"fused turn: {response}")
+
+        # Parse the result
+        result = None
+        try:
+            parsed = json.loads(response[response.index("{"):response.rindex("}") + 1])
+            result = {
+                "updates": parsed.get("updates") if isinstance(parsed.get("updates"), dict) else {},
+                "intent":  str(parsed.get("intent", "none")).strip().lower(),
+                "reply":   parsed.get("reply") or None
+            }
+        except Exception as e:
+            log.warning(f"Unable to parse the fused turn result: {e}")
+
+        return result
+    
+
     # Load dialog examples by RAG
     def load_dialog_examples_by_rag(self):    
         '''
@@ -511,50 +713,9 @@ class CForm():
         ]
         '''
 
-        # Get examples
-        examples = self.model.examples(self.cat)
-        #print(f"examples: {examples}")
-
-        # If no examples are available, return
-        if not examples:
-            return
-        
-        # Create example selector
-        example_selector = SemanticSimilarityExampleSelector.from_examples(
-            examples, self.cat.embedder, Qdrant, k=1, location=':memory:'
-        )
-
-        # Create example_update_model_prompt for formatting output
-        example_update_model_prompt = PromptTemplate(
-            input_variables = ["user_message", "model_before", "model_after"],
-            template = "User Message: {user_message}\nModel: {model_before}\nUpdated Model: {model_after}"
-        )
-        #print(f"example_update_model_prompt:\n{example_update_model_prompt.format(**examples[1])}\n\n")
-
-        # Create promptTemplate from examples_selector and example_update_model_prompt
-        self.prompt_tpl_update = FewShotPromptTemplate(
-            example_selector = example_selector,
-            example_prompt   = example_update_model_prompt,
-            suffix = "User Message: {user_message}\nModel: {model}\nUpdated Model: ",
-            input_variables = ["user_message", "model"]
-        )
-        #print(f"prompt_tpl_update: {self.prompt_tpl_update.format(user_message='user question', model=self.model.model_dump_json())}\n\n")
-
-        # Create example_response_prompt for formatting output
-        example_response_prompt = PromptTemplate(
-            input_variables = ["validation", "response"],
-            template = "Message: {validation}\nResponse: {response}"
-        )
-        #print(f"example_response_prompt:\n{example_response_prompt.format(**examples[1])}\n\n")
-
-        # Create promptTemplate from examples_selector and example_response_prompt
-        self.prompt_tpl_response = FewShotPromptTemplate(
-            example_selector = example_selector,
-            example_prompt   = example_response_prompt,
-            suffix = "Message: {validation}\nResponse: ",
-            input_variables = ["validation"]
-        )
-        #print(f"prompt_tpl_response: {self.prompt_tpl_response.format(validation='pydantic validation result')}\n\n")
+        # The prompt templates are shared by all the forms of this model class
+        self.prompt_tpl_update   = self.machinery.prompt_tpl_update
+        self.prompt_tpl_response = self.machinery.prompt_tpl_response
 
 
     ####################################
@@ -562,50 +723,57 @@ class CForm():
     ####################################
     
     # Execute the dialogue step
+    # (traced as a turn span, with a child span for each phase)
     def dialogue(self):
         # Get settings
-        settings = self.cat.mad_hatter.get_plugin().load_settings()
+        settings = get_settings(self.cat)
+        tracer.configure(settings)
 
-        # Based on the strict setting it decides whether to use a direct dialogue or involve the memory chain 
-        if settings["strict"] is True:
-            return self.dialogue_direct()
-        else:
-            return self.dialogue_action()
+        with tracer.span("turn", form=self.key, state_before=self.state.name) as span:
+            # Based on the strict setting it decides whether to use a direct dialogue or involve the memory chain 
+            if settings["strict"] is True:
+                response = self.dialogue_direct()
+            else:
+                response = self.dialogue_action()
+            span.set(state_after=self.state.name)
+
+        self.save()
+        return response
 
 
     # Execute the dialogue action
     def dialogue_action(self):
-        log.critical(f"dialogue_action (state: {self.state})")
+        log.debug(f"dialogue_action (state: {self.state})")
 
         #self.cat.working_memory["episodic_memories"] = []
 
         # Get settings
-        settings = self.cat.mad_hatter.get_plugin().load_settings()
+        settings = get_settings(self.cat)
         
         # If the state is INVALID or UPDATE, execute model update (and change state based on validation result)
         if self.state in [CFormState.INVALID, CFormState.UPDATE]:
             self.update()
-            log.warning("> UPDATE")
+            log.debug("> UPDATE")
 
         # If state is VALID, ask confirm (or execute action directly)
         if self.state in [CFormState.VALID]:
             if settings["ask_confirm"] is False:
-                log.warning("> EXECUTE ACTION")
-                del self.cat.working_memory[self.key]   
+                log.debug("> EXECUTE ACTION")
+                self.close()
                 return self.model.execute_action(self.cat)
             else:
                 self.state = CFormState.WAIT_CONFIRM
-                log.warning("> STATE=WAIT_CONFIRM")
+                log.debug("> STATE=WAIT_CONFIRM")
                 return None
             
         # If state is WAIT_CONFIRM, check user confirm response..
         if self.state in [CFormState.WAIT_CONFIRM]:
-            if self.check_user_confirm():
-                log.warning("> EXECUTE ACTION")
-                del self.cat.working_memory[self.key]   
+            if self.turn_result("confirm", self.check_user_confirm):
+                log.debug("> EXECUTE ACTION")
+                self.close()
                 return self.model.execute_action(self.cat)
             else:
-                log.warning("> STATE=UPDATE")
+                log.debug("> STATE=UPDATE")
                 self.state = CFormState.UPDATE
                 return None
 
@@ -614,15 +782,16 @@ class CForm():
 
     # execute dialog prompt prefix
     def dialogue_prompt(self, prompt_prefix):
-        log.critical(f"dialogue_prompt (state: {self.state})")
+        with tracer.span("prompt_build", form=self.key):
+            return self._dialogue_prompt(prompt_prefix)
+
+
+    # Build the dialog prompt prefix
+    def _dialogue_prompt(self, prompt_prefix):
+        log.debug(f"dialogue_prompt (state: {self.state})")
 
-        # Get class fields descriptions
-        class_descriptions = []
-        for key, value in self.model_class.model_fields.items():
-            class_descriptions.append(f"{key}: {value.description}")
-        
         # Formatted texts
-        formatted_model_class = ", ".join(class_descriptions)
+        formatted_model_class = CompiledForms.get(self.model_class).formatted_field_descriptions
         formatted_model       = ", ".join([f"{key}: {value}" for key, value in self.model.model_dump().items()])
         formatted_ask_for     = ", ".join(self.ask_for) if self.ask_for else None
         formatted_errors      = ", ".join(self.errors) if self.errors else None
@@ -637,50 +806,30 @@ class CForm():
 
         # If state is INVALID ask missing informations..
         if self.state in [CFormState.INVALID]:
-            # PROMPT ASK MISSING INFO
-            prompt = \
-                f"Your goal is to have the user fill out a form containing the following fields:\n\
-                {formatted_model_class}\n\n\
-                you have currently collected the following values:\n\
-                {formatted_model}\n\n"
-
-            if self.errors:
-                prompt += \
-                    f"and in the validation you got the following errors:\n\
-                    {formatted_errors}\n\n"
-
-            if self.ask_for:    
-                prompt += \
-                    f"and the following fields are still missing:\n\
-                    {formatted_ask_for}\n\n"
-
-            prompt += \
-                f"ask the user to give you the necessary information."
-            
+            examples, query = [], ""
             if self.prompt_tpl_response:
-                prompt += "\n\n" + self.prompt_tpl_response.format(validation = formatted_validation)
+                examples, query = self.few_shot(self.prompt_tpl_response, validation = formatted_validation)
+
+            # PROMPT ASK MISSING INFO
+            prompt = self.render_prompt(
+                ASK_MISSING_PROMPT,
+                examples = examples,
+                fields   = formatted_model_class,
+                model    = formatted_model,
+                errors   = f"and in the validation you got the following errors:\n{formatted_errors}" if self.errors else "",
+                ask_for  = f"and the following fields are still missing:\n{formatted_ask_for}" if self.ask_for else "",
+                query    = query
+            )
                 
         # If state is WAIT_CONFIRM (previous VALID), show summary and ask the user for confirmation..
         if self.state in [CFormState.WAIT_CONFIRM]:
             # PROMPT SHOW SUMMARY
-            prompt = f"Your goal is to have the user fill out a form containing the following fields:\n\
-                {formatted_model_class}\n\n\
-                you have collected all the available data:\n\
-                {formatted_model}\n\n\
-                show the user the data and ask them to confirm that it is correct.\n"
+            prompt = self.render_prompt(SHOW_SUMMARY_PROMPT, fields=formatted_model_class, model=formatted_model)
 
         # If state is UPDATE asks the user to change some information present in the model..
         if self.state in [CFormState.UPDATE]:
             # PROMPT ASK CHANGE INFO
-            prompt = f"Your goal is to have the user fill out a form containing the following fields:\n\
-                {formatted_model_class}\n\n\
-                you have collected all the available data:\n\
-                {formatted_model}\n\n\
-                show the user the data and ask him to provide the updated data.\n"
-
-
-        # Print prompt prefix
-        print("*"*10, f"\nPROMPT PREFIX:\n{prompt}\n", "*"*10)
+            prompt = self.render_prompt(ASK_CHANGE_PROMPT, fields=formatted_model_class, model=formatted_model)
 
         # Return prompt
         return prompt
@@ -688,41 +837,152 @@ class CForm():
 
     # execute dialog direct (combines the previous two methods)
     def dialogue_direct(self):
-
-        # check exit intent
-        if self.check_exit_intent_rag():
-            log.critical(f'> Exit Intent {self.key}')
-            del self.cat.working_memory[self.key]
+        settings = get_settings(self.cat)
+
+        # In fused mode a single LLM call extracts the fields, classifies the intent and generates the reply
+        fused_result = None
+        if settings["json_extractor"] == "fused":
+            fused_result = self.fused_turn()
+
+        # check exit intent (concurrently with the other checks that depend only on the user message)
+        if fused_result is not None:
+            exit_intent = fused_result["intent"] == "exit"
+        elif settings["parallel_checks"] is True:
+            exit_intent = self.run_turn_phases()
+        else:
+            exit_intent = self.run_phase("exit_check", self.check_exit_intent_rag)
+        if exit_intent:
+            log.debug(f'> Exit Intent {self.key}')
+            self.close()
             return None
     
         # Get dialog action
         response = self.dialogue_action()
+
+        # Use the fused reply (unless the validation found errors the LLM could not know about)
+        if not response and fused_result is not None and fused_result["reply"] and not self.errors:
+            response = fused_result["reply"]
+
         if not response:
             # Build prompt
             user_message = self.cat.working_memory["user_message_json"]["text"]
             prompt_prefix = self.cat.mad_hatter.execute_hook("agent_prompt_prefix", MAIN_PROMPT_PREFIX, cat=self.cat)
             prompt_prefix = self.dialogue_prompt(prompt_prefix)
-            prompt_prefix += f"\nUse the {self.language} language to answer the question.\n\n"
-            prompt = f"{prompt_prefix}\n\n\
-                User message: {user_message}\n\
-                AI:"
-            
-            # Print prompt
-            print("*"*10, f"\nPROMPT:\n{prompt}\n", "*"*10)
+            prompt = self.render_prompt(DIALOGUE_PROMPT, prefix=prompt_prefix, language=self.language, user_message=user_message)
 
-            # Call LLM
-            response = self.cat.llm(prompt)
+            # Call LLM (streaming the tokens to the user, if enabled)
+            with tracer.span("generation", form=self.key, stream=settings["stream_response"]):
+                if settings["stream_response"] is True:
+                    tracer.count(llm_calls=1, prompt_chars=len(prompt))
+                    response = llm_stream(self.cat, prompt)
+                else:
+                    response = self.llm(prompt)
 
         return response
     
     
+    # Run exit check, extraction and confirm check concurrently, return the exit check result
+    # (the other results are kept for update and dialogue_action; they are discarded if the user wants to exit)
+    def run_turn_phases(self):
+        phases = {"exit": lambda: self.run_phase("exit_check", self.check_exit_intent_rag)}
+        if self.state in [CFormState.INVALID, CFormState.UPDATE]:
+            phases["extraction"] = lambda: self.run_phase("extraction", self.user_message_to_json)
+        if self.state in [CFormState.WAIT_CONFIRM]:
+            phases["confirm"] = lambda: self.run_phase("confirm", self.check_user_confirm)
+
+        results = TurnExecutor.run(phases, first="exit", stop_if=lambda exit_intent: exit_intent is True)
+        TurnContext.current(self.cat).set(("phases", self.key), results)
+        return results["exit"]
+
+
+    # Get a result computed by run_turn_phases for the current user message (or compute it now)
+    def turn_result(self, name, fn):
+        results = TurnContext.current(self.cat).values.get(("phases", self.key))
+        if results and name in results:
+            return results.pop(name)
+        return self.run_phase(name, fn)
+
+
+    # Run a phase of the turn inside a tracing span
+    def run_phase(self, name, fn):
+        with tracer.span(name, form=self.key):
+            return fn()
+
+
+    # Query the LLM (counting the call in the current span)
+    def llm(self, prompt):
+        response = self.cat.llm(prompt)
+        tracer.count(llm_calls=1, prompt_chars=len(prompt), response_chars=len(response))
+        return response
+
+
+    # Queries the LLM for an extraction
+    # (with the batch extraction setting the prompt is sent with the ones of the other sessions in a single request,
+    # if the llm accepts several prompts in one request)
+    def extraction_llm(self, prompt):
+        settings = get_settings(self.cat)
+        if settings["batch_extraction"] is not True:
+            return self.llm(prompt)
+
+        backend = get_batch_backend(self.cat._llm)
+        if backend is None:
+            return self.llm(prompt)
+
+        extraction_batcher.configure(settings)
+        try:
+            response = extraction_batcher.generate(backend, prompt)
+        except Exception as e:
+            log.warning(f"Batch extraction failed, the LLM is queried directly: {e}")
+            return self.llm(prompt)
+        tracer.count(llm_calls=1, batched_llm_calls=1, prompt_chars=len(prompt), response_chars=len(response))
+        return response
+
+
+    # Get a classification result of the user message from the result cache (or compute it)
+    # (semantic also looks up the results of similar messages, if guard(message, similar message) accepts them)
+    def cached_result(self, kind, fn, semantic=True, guard=None, variant=None):
+        result_cache.configure(get_settings(self.cat))
+        user_message = self.cat.working_memory["user_message_json"]["text"]
+        return result_cache.cached(kind, user_message, fn, self.user_message_vector if semantic else None, guard, variant)
+
+
+    # Get the user message vector (computed once per user message)
+    def user_message_vector(self):
+        return TurnContext.current(self.cat).get("user_message_vector", lambda: self.embedder.embed_query(
+            self.cat.working_memory["user_message_json"]["text"]
+        ))
+
+
+    # Get the few-shot examples and the query of a few-shot prompt template
+    # (the examples are selected once per user message for the same template inputs)
+    def few_shot(self, prompt_tpl, **kwargs):
+        selector = prompt_tpl.example_selector
+        key = ("examples", id(selector), tuple(sorted(kwargs.items())))
+        examples = TurnContext.current(self.cat).get(key, lambda: selector.select_examples(kwargs))
+
+        # Same formatting of FewShotPromptTemplate
+        input_variables = prompt_tpl.example_prompt.input_variables
+        example_strings = [
+            prompt_tpl.example_prompt.format(**{k: example[k] for k in input_variables}) for example in examples
+        ]
+        return example_strings, prompt_tpl.suffix.format(**kwargs)
+
+
+    # Render a prompt within the token budget of the settings
+    def render_prompt(self, prompt, examples=None, **values):
+        settings = get_settings(self.cat)
+        return prompt.render(examples, budget=settings.get("prompt_token_budget", 0), **values)
+
+
     # Execute the entire memory chain
-    def execute_memory_chain(self):
+    # (form_prompt=False answers without the form prompt prefix, e.g. after the form is stopped)
+    def execute_memory_chain(self, form_prompt=True):
         agent_input   = self.cat.agent_manager.format_agent_input(self.cat.working_memory)
         agent_input   = self.cat.mad_hatter.execute_hook("before_agent_starts", agent_input, cat=self.cat)
         agent_input["tools_output"] = ""
         prompt_prefix = self.cat.mad_hatter.execute_hook("agent_prompt_prefix", MAIN_PROMPT_PREFIX, cat=self.cat)
-        prompt_prefix = self.dialogue_prompt(prompt_prefix)
+        if form_prompt:
+            prompt_prefix = self.dialogue_prompt(prompt_prefix)
         prompt_suffix = self.cat.mad_hatter.execute_hook("agent_prompt_suffix", MAIN_PROMPT_SUFFIX, cat=self.cat)
         response = self.cat.agent_manager.execute_memory_chain(agent_input, prompt_prefix, prompt_suffix, self.cat)
         return response.get("output")
@@ -734,13 +994,29 @@ class CForm():
 
 # Class Conversational Base Model
 class CBaseModel(BaseModel):
+
+    # Messages that start and stop the form (used by the fast router)
+    start_examples: ClassVar[List[str]] = []
+    stop_examples:  ClassVar[List[str]] = []
+
+    # CForm subclass used when the fast router starts the form
+    form_class: ClassVar[Optional[type]] = None
+
+    # Fields to validate again when a field changes (field -> dependent fields)
+    field_dependencies: ClassVar[Dict[str, List[str]]] = {}
+
+    # Register the CBaseModel subclasses (to resume their sessions)
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        FormRegistry.register_model(cls)
     
     # Get CForm instance
     @classmethod
     def get(cls, cat):
         key = cls.__name__
-        if key in cat.working_memory.keys():
-            return cat.working_memory[key]
+        session = SessionStores.sessions(cat).get(key)
+        if session is not None:
+            return CForm.from_session(cat, key, session)
         return None
     
     # Start conversation
@@ -748,13 +1024,14 @@ class CBaseModel(BaseModel):
     @classmethod
     def start(cls, cat, form=CForm):
         key = cls.__name__
-        if key not in cat.working_memory.keys():
+        if key not in SessionStores.sessions(cat):
             cform = form(cls, key, cat)
-            cat.working_memory[key] = cform
+            SessionStores.save(cat, key, cform.session)
+            TurnContext.current(cat).set(("form", key), cform)
             cform.check_active_form()
             response = cform.dialogue()
             return response
-        cform = cat.working_memory[key]
+        cform = cls.get(cat)
         cform.check_active_form()
         response = cform.execute_memory_chain()
         return response
@@ -763,18 +1040,15 @@ class CBaseModel(BaseModel):
     # (typically inside the tool that stops the intent)
     @classmethod
     def stop(cls, cat):
-        key = cls.__name__
-        if key in cat.working_memory.keys():
-            del cat.working_memory[key]
+        SessionStores.delete(cat, cls.__name__)
         return
 
     # Execute the dialogue step
     # (typically inside the agent_fast_reply hook)
     @classmethod
     def dialogue(cls, fast_reply, cat):
-        key = cls.__name__
-        if key in cat.working_memory.keys():
-            cform = cat.working_memory[key]
+        cform = cls.get(cat)
+        if cform:
             response = cform.dialogue()
             if response:
                 return { "output": response }
@@ -784,9 +1058,8 @@ class CBaseModel(BaseModel):
     # (typically inside the agent_prompt_prefix hook)
     @classmethod
     def dialogue_prompt(cls, prefix, cat):
-        key = cls.__name__
-        if key in cat.working_memory.keys():
-            cform = cat.working_memory[key]
+        cform = cls.get(cat)
+        if cform:
             return cform.dialogue_prompt(prefix)
         return prefix
 
@@ -808,7 +1081,11 @@ class CBaseModel(BaseModel):
 
 @hook
 def agent_fast_reply(fast_reply: Dict, cat) -> Dict:
-    settings = cat.mad_hatter.get_plugin().load_settings()
+    settings = get_settings(cat)
+    if settings.get("use_fast_router") is True:
+        routed = FormRouter.route(cat, settings)
+        if routed is not None:
+            return routed
     if settings["auto_handle_conversation"] is True:
         cform = CForm.get_active_form(cat)
         if cform:
@@ -817,9 +1094,30 @@ def agent_fast_reply(fast_reply: Dict, cat) -> Dict:
 
 @hook
 def agent_prompt_prefix(prefix, cat) -> str:
-    settings = cat.mad_hatter.get_plugin().load_settings()
+    settings = get_settings(cat)
     if settings["auto_handle_conversation"] is True:
         cform = CForm.get_active_form(cat)
         if cform:
             return cform.model.dialogue_prompt(prefix, cat)
     return prefix
+
+# Drop the turn context when the reply is sent
+@hook
+def before_cat_sends_message(message, cat):
+    TurnContext.end(cat)
+    return message
+
+# Compile the extraction artifacts of every form and publish the intent collections when the cat starts
+# (the only place where the intent collections are rebuilt)
+@hook
+def after_cat_bootstrap(cat):
+    CompiledForms.compile_all(CBaseModel)
+    try:
+        embedder = get_cached_embedder(cat, SettingsSnapshot.load(cat))
+        qclient  = cat.memory.vectors.vector_db
+        IntentCollections.refresh(qclient, embedder, INTENT_COLLECTION, intent_examples())
+        router_examples = FormRouter.examples()
+        if router_examples:
+            IntentCollections.refresh(qclient, embedder, FormRouter.collection_name, router_examples)
+    except Exception as e:
+        log.error(f"Unable to refresh the intent collections: {e}")
@@ -0,0 +1,175 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from langchain.llms.base import BaseLLM, LLM
+from cat.log import log
+import threading
+import queue
+import time
+
+
+##########################
+######## BACKENDS ########
+##########################
+
+# Check that an llm sends several prompts in a single request
+# (the chat models and the simple LLM subclasses generate the prompts one after the other)
+def supports_batch(llm):
+    return isinstance(llm, BaseLLM) and type(llm)._generate is not LLM._generate
+
+
+# Batch backend of a langchain llm (all the prompts in a single generate call)
+class LLMBatchBackend():
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    # Get the responses of the prompts
+    def generate(self, prompts):
+        result = self.llm.generate(prompts)
+        return [generations[0].text for generations in result.generations]
+
+
+# Local stub backend
+# (answers each prompt with fn, one request takes latency seconds; records the batch sizes)
+class StubBatchBackend():
+
+    def __init__(self, fn, latency=0.0):
+        self.fn = fn
+        self.latency = latency
+        self.batch_sizes = []
+
+    # Get the responses of the prompts
+    def generate(self, prompts):
+        self.batch_sizes.append(len(prompts))
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.fn(prompt) for prompt in prompts]
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+# Register the batch backend of an llm (e.g. a StubBatchBackend, or a client with its own batch api)
+def register_batch_backend(llm, backend):
+    with _backends_lock:
+        _backends[id(llm)] = (llm, backend)
+
+# Get the batch backend of an llm (None if the llm cannot batch: its prompts are sent directly)
+def get_batch_backend(llm):
+    registered = _backends.get(id(llm))
+    if registered is not None and registered[0] is llm:
+        return registered[1]
+    if not supports_batch(llm):
+        return None
+    with _backends_lock:
+        backend = LLMBatchBackend(llm)
+        _backends[id(llm)] = (llm, backend)
+        return backend
+
+
+#########################
+######## BATCHER ########
+#########################
+
+# Extraction batcher
+# (collects the extraction prompts of the concurrent sessions for at most max_wait seconds or max_size prompts,
+# sends them to their backend in a single request and routes each response back to its caller;
+# the requests are sent from a thread pool, so the collection goes on while they are running)
+class ExtractionBatcher():
+
+    max_requests = 16
+
+    def __init__(self, max_wait=0.01, max_size=16):
+        self.max_wait = max_wait
+        self.max_size = max_size
+        self.queue    = queue.Queue()
+        self.lock     = threading.Lock()
+        self.worker   = None
+        self.pool     = None
+
+        # Batch counters
+        self.counters = {"batches": 0, "prompts": 0, "errors": 0}
+
+    # Update max wait and max size from the settings
+    def configure(self, settings):
+        self.max_wait = float(settings.get("batch_max_wait_ms", self.max_wait * 1000)) / 1000
+        self.max_size = max(1, int(settings.get("batch_max_size", self.max_size)))
+
+    # Submit a prompt, return the future of its response
+    def submit(self, backend, prompt):
+        future = Future()
+        self._start()
+        self.queue.put((backend, prompt, future))
+        return future
+
+    # Get the response of a prompt (waits for its batch)
+    def generate(self, backend, prompt, timeout=None):
+        return self.submit(backend, prompt).result(timeout=timeout)
+
+    # Get the batch counters and the mean fill rate (prompts per batch / max size)
+    def stats(self):
+        with self.lock:
+            batches = self.counters["batches"]
+            return dict(
+                self.counters,
+                mean_batch_size=self.counters["prompts"] / batches if batches else 0.0,
+                fill_rate=self.counters["prompts"] / (batches * self.max_size) if batches else 0.0
+            )
+
+    # Start the worker thread (once)
+    def _start(self):
+        if self.worker is not None:
+            return
+        with self.lock:
+            if self.worker is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.max_requests, thread_name_prefix="cform-batch")
+                self.worker = threading.Thread(target=self._run, name="cform-batcher", daemon=True)
+                self.worker.start()
+
+    # Worker loop
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+
+            # Wait for the other prompts until the batch is full or the max wait is over
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # One request for each backend
+            groups = {}
+            for backend, prompt, future in batch:
+                groups.setdefault(id(backend), (backend, []))[1].append((prompt, future))
+            for backend, items in groups.values():
+                self.pool.submit(self._send, backend, items)
+
+    # Send a batch to a backend and resolve the futures
+    def _send(self, backend, items):
+        start = time.perf_counter()
+        try:
+            responses = backend.generate([prompt for prompt, _ in items])
+            if len(responses) != len(items):
+                raise ValueError(f"{len(responses)} responses for {len(items)} prompts")
+        except Exception as e:
+            log.error(f"Extraction batch failed: {e}")
+            with self.lock:
+                self.counters["errors"] += 1
+            for _, future in items:
+                future.set_exception(e)
+            return
+
+        with self.lock:
+            self.counters["batches"] += 1
+            self.counters["prompts"] += len(items)
+        log.debug(f"Extraction batch of {len(items)}/{self.max_size} prompts ({time.perf_counter() - start:.3f}s)")
+        for (_, future), response in zip(items, responses):
+            future.set_result(response)
+
+
+# Shared extraction batcher
+extraction_batcher = ExtractionBatcher()
@@ -0,0 +1,136 @@
+from pydantic import create_model
+from langchain.prompts.prompt import PromptTemplate
+from langchain.output_parsers import PydanticOutputParser
+import guardrails as gd #https://www.guardrailsai.com/docs/guardrails_ai/getting_started
+from kor import create_extraction_chain, from_pydantic #https://github.com/eyurtsev/kor
+from cat.log import log
+from .cform_extractors import get_field_extractors
+from .cform_validation import FieldValidator
+import threading
+import json
+import re
+
+
+# Guardrails extraction prompt
+GUARDRAILS_PROMPT = """
+Given the following client message, please extract information about his form.
+
+${message}
+
+${gr.complete_json_suffix_v2}
+"""
+
+
+# Create a model class with a subset of the fields of a model class
+# (same name, field types and descriptions; the validators are left to the form validation)
+def create_sub_model(model_class, fields):
+    return create_model(
+        model_class.__name__,
+        **{field: (model_class.model_fields[field].annotation, model_class.model_fields[field]) for field in fields}
+    )
+
+
+# Get the keywords of each field
+# (the words of the field name and description that do not appear in the other fields)
+def get_field_keywords(model_class):
+    words = {}
+    for key, value in model_class.model_fields.items():
+        text = f"{key.replace('_', ' ')} {value.description or ''}".lower()
+        words[key] = {word for word in re.findall(r"[^\W\d_]{3,}", text)}
+
+    keywords = {}
+    for key, field_words in words.items():
+        others = set().union(*[other for other_key, other in words.items() if other_key != key])
+        keywords[key] = field_words - others
+    return keywords
+
+
+# Compiled form
+# (extraction artifacts of a CBaseModel subclass, built once and shared by all sessions)
+class CompiledForm():
+
+    def __init__(self, model_class):
+        self.model_class = model_class
+
+        # Json schema
+        self.json_schema = model_class.model_json_schema()
+        self.json_schema_str = json.dumps(self.json_schema)
+
+        # Field descriptions
+        self.field_descriptions = {key: value.description for key, value in model_class.model_fields.items()}
+        self.formatted_field_descriptions = ", ".join(f"{key}: {value}" for key, value in self.field_descriptions.items())
+        self.required_fields = [key for key, value in model_class.model_fields.items() if value.is_required()]
+        self.field_keywords = get_field_keywords(model_class)
+
+        # Deterministic field extractors
+        self.field_extractors = get_field_extractors(model_class)
+
+        # Field level validator
+        self.field_validator = FieldValidator(model_class)
+
+        # Langchain parser and prompt
+        self.parser = PydanticOutputParser(pydantic_object=model_class)
+        self.format_instructions = self.parser.get_format_instructions()
+        self.langchain_prompt = PromptTemplate(
+            template="Answer the user query.\n{format_instructions}\n{query}\n",
+            input_variables=["query"],
+            partial_variables={"format_instructions": self.format_instructions},
+        )
+
+        # Guardrails guard
+        self.guard = gd.Guard.from_pydantic(output_class=model_class, prompt=GUARDRAILS_PROMPT)
+
+        # Kor schema and validator (the chains depend on the llm)
+        self.kor_schema, self.kor_validator = from_pydantic(model_class)
+        self._kor_chains = {}
+        self._lock = threading.Lock()
+
+    # Get the kor extraction chain for an llm
+    def kor_chain(self, llm):
+        chain = self._kor_chains.get(id(llm))
+        if chain is not None and chain.llm is llm:
+            return chain
+        with self._lock:
+            chain = create_extraction_chain(
+                llm,
+                self.kor_schema,
+                encoder_or_encoder_class="json",
+                validator=self.kor_validator
+            )
+            self._kor_chains = {id(llm): chain}
+            return chain
+
+
+# Compiled forms registry
+class CompiledForms():
+
+    _forms = {}
+    _lock = threading.Lock()
+
+    # Get the compiled form of a model class (compiled on first use)
+    # (with fields, the compiled form of the model restricted to those fields)
+    @classmethod
+    def get(cls, model_class, fields=None):
+        key = model_class if fields is None else (model_class, tuple(fields))
+        compiled = cls._forms.get(key)
+        if compiled is not None:
+            return compiled
+        with cls._lock:
+            compiled = cls._forms.get(key)
+            if compiled is None:
+                log.info(f"Compile form {model_class.__name__} (fields: {fields or 'all'})")
+                compiled = CompiledForm(model_class if fields is None else create_sub_model(model_class, fields))
+                cls._forms[key] = compiled
+            return compiled
+
+    # Compile every subclass of the base model class
+    @classmethod
+    def compile_all(cls, base_class):
+        subclasses = list(base_class.__subclasses__())
+        while subclasses:
+            model_class = subclasses.pop()
+            subclasses.extend(model_class.__subclasses__())
+            try:
+                cls.get(model_class)
+            except Exception as e:
+                log.error(f"Unable to compile form {model_class.__name__}: {e}")
@@ -0,0 +1,194 @@
+from cat.log import log
+import functools
+import json
+import re
+
+
+# Confirm lexicon
+# (for each language: acceptances, refusals, negations, contrast words and fillers, the words that do not change the meaning)
+CONFIRM_LEXICON = {
+    "en": {
+        "yes":       ["yes", "yeah", "yep", "ok", "okay", "sure", "correct", "right", "fine", "good", "perfect",
+                      "confirm", "confirmed", "exactly", "all good", "that's right", "that's correct", "go ahead",
+                      "looks good", "of course", "absolutely", "i confirm"],
+        "no":        ["no", "nope", "nah", "wrong", "incorrect", "cancel", "not correct", "not right", "mistake",
+                      "negative", "change"],
+        "negations": ["not", "no", "don't", "isn't", "aren't", "never", "doesn't"],
+        "contrast":  ["but", "however", "except", "although"],
+        "fillers":   ["it", "is", "it's", "they", "are", "they're", "that", "that's", "all", "everything", "the", "data",
+                      "seems", "seem", "looks", "thanks", "thank", "you", "please", "very", "so"]
+    },
+    "it": {
+        "yes":       ["sì", "si", "certo", "ok", "va bene", "corretto", "corretti", "giusto", "giusti", "esatto",
+                      "perfetto", "confermo", "confermato", "tutto ok", "tutto bene", "d'accordo", "vai"],
+        "no":        ["no", "sbagliato", "sbagliati", "errato", "errati", "annulla", "cambia", "modifica"],
+        "negations": ["non", "no", "mai"],
+        "contrast":  ["ma", "però", "tranne", "eccetto"],
+        "fillers":   ["è", "e'", "sono", "tutto", "tutti", "i", "dati", "va", "mi", "sembra", "sembrano", "grazie",
+                      "molto", "per", "favore"]
+    },
+    "fr": {
+        "yes":       ["oui", "ouais", "d'accord", "ok", "correct", "exact", "parfait", "bien", "c'est bon",
+                      "je confirme", "confirmé", "bien sûr"],
+        "no":        ["non", "faux", "incorrect", "erreur", "annuler", "changer"],
+        "negations": ["ne", "pas", "non", "jamais"],
+        "contrast":  ["mais", "sauf", "cependant"],
+        "fillers":   ["c'est", "est", "ce", "sont", "tout", "les", "données", "ça", "merci", "très", "me", "semble"]
+    },
+    "es": {
+        "yes":       ["sí", "si", "claro", "vale", "ok", "correcto", "correctos", "perfecto", "exacto", "bien",
+                      "de acuerdo", "confirmo", "por supuesto"],
+        "no":        ["no", "incorrecto", "incorrectos", "mal", "error", "cancelar", "cambiar"],
+        "negations": ["no", "nunca"],
+        "contrast":  ["pero", "excepto", "salvo"],
+        "fillers":   ["es", "está", "son", "están", "todo", "los", "datos", "gracias", "muy", "me", "parece"]
+    },
+    "de": {
+        "yes":       ["ja", "jawohl", "genau", "ok", "okay", "richtig", "korrekt", "stimmt", "passt", "gut",
+                      "perfekt", "einverstanden", "klar", "bestätigt"],
+        "no":        ["nein", "falsch", "fehler", "abbrechen", "ändern"],
+        "negations": ["nicht", "kein", "keine", "nie"],
+        "contrast":  ["aber", "außer", "jedoch"],
+        "fillers":   ["das", "ist", "es", "sind", "alles", "die", "daten", "danke", "sehr", "so"]
+    },
+    "pt": {
+        "yes":       ["sim", "claro", "ok", "certo", "correto", "corretos", "perfeito", "exato", "tudo bem",
+                      "de acordo", "confirmo", "com certeza"],
+        "no":        ["não", "nao", "errado", "errados", "incorreto", "cancelar", "mudar"],
+        "negations": ["não", "nao", "nunca"],
+        "contrast":  ["mas", "exceto", "porém"],
+        "fillers":   ["é", "está", "são", "estão", "tudo", "os", "dados", "obrigado", "obrigada", "muito"]
+    }
+}
+
+
+# Merge two lexicons (the lists of the extension are added to the base ones)
+def merge_lexicons(base, extension):
+    merged = {language: {key: list(values) for key, values in entries.items()} for language, entries in base.items()}
+    for language, entries in (extension or {}).items():
+        target = merged.setdefault(language, {"yes": [], "no": [], "negations": [], "contrast": [], "fillers": []})
+        for key, values in entries.items():
+            target.setdefault(key, []).extend(value.lower() for value in values)
+    return merged
+
+
+# Split a text in lowercase words
+def tokenize(text):
+    return re.findall(r"[^\W\d_]+(?:'[^\W\d_]+)?", text.lower())
+
+
+# Negation words of every language
+NEGATION_WORDS = {word for entries in CONFIRM_LEXICON.values() for word in entries["negations"]}
+
+
+# Check that two messages contain the same negations
+# (a confirm cached for "they are correct" must not answer "they are not correct")
+def same_negations(text, other_text):
+    return {word for word in tokenize(text) if word in NEGATION_WORDS} == \
+           {word for word in tokenize(other_text) if word in NEGATION_WORDS}
+
+
+# Local confirm classifier
+# (lexicon phrases with negation handling; ambiguous messages return None)
+class ConfirmClassifier():
+
+    max_words = 8
+
+    def __init__(self, lexicon=CONFIRM_LEXICON):
+        self.lexicon = lexicon
+
+        # Phrases as word tuples, for each language
+        self._language_phrases = {}
+        self.phrases = {}
+        for language, entries in lexicon.items():
+            self.phrases[language] = {
+                "yes":       {tuple(tokenize(phrase)) for phrase in entries.get("yes", [])},
+                "no":        {tuple(tokenize(phrase)) for phrase in entries.get("no", [])},
+                "negations": {tuple(tokenize(phrase)) for phrase in entries.get("negations", [])},
+                "contrast":  {tuple(tokenize(phrase)) for phrase in entries.get("contrast", [])},
+                "fillers":   {tuple(tokenize(phrase)) for phrase in entries.get("fillers", [])}
+            }
+
+    # Get the phrases of a language (and english), all the languages if it is unknown
+    # (with the length of the longest phrase)
+    def language_phrases(self, language):
+        if language not in self.phrases:
+            language = None
+        if language in self._language_phrases:
+            return self._language_phrases[language]
+
+        languages = [language, "en"] if language is not None else list(self.phrases.keys())
+        phrases = {"yes": set(), "no": set(), "negations": set(), "contrast": set(), "fillers": set()}
+        for code in languages:
+            for key in phrases:
+                phrases[key] |= self.phrases.get(code, {}).get(key, set())
+        longest = max((len(phrase) for key in phrases for phrase in phrases[key]), default=1)
+        self._language_phrases[language] = (phrases, longest)
+        return phrases, longest
+
+    # Classify a message: True (confirm), False (deny) or None (ambiguous)
+    # (the questions, e.g. "is it right?", are ambiguous)
+    def classify(self, text, language=None):
+        if text.strip().endswith("?"):
+            return None
+
+        words = tokenize(text)
+        if not words or len(words) > self.max_words:
+            return None
+
+        phrases, longest = self.language_phrases(language)
+
+        # Match the longest phrases first
+        matches = []
+        i = 0
+        while i < len(words):
+            for size in range(min(longest, len(words) - i), 0, -1):
+                phrase = tuple(words[i:i + size])
+                kind = next((key for key in ["yes", "no", "contrast"] if phrase in phrases[key]), None)
+                if kind is None and phrase in phrases["negations"]:
+                    kind = "negation"
+                if kind is None and phrase in phrases["fillers"]:
+                    kind = "filler"
+                if kind is not None:
+                    matches.append(kind)
+                    i += size
+                    break
+            else:
+                matches.append(None)
+                i += 1
+
+        # Contrast words and unknown words make the message ambiguous
+        if "contrast" in matches or None in matches:
+            return None
+
+        # A negation flips the following acceptance ("not correct"), a negated refusal is ambiguous
+        polarity = set()
+        negated = False
+        for kind in matches:
+            if kind == "filler":
+                continue
+            if kind == "negation":
+                negated = True
+                continue
+            if negated and kind == "no":
+                return None
+            polarity.add(kind == "yes" and not negated)
+            negated = False
+        if negated:
+            polarity.add(False)
+
+        if len(polarity) == 1:
+            return polarity.pop()
+        return None
+
+
+# Get the confirm classifier for a lexicon extension (json)
+# (an invalid extension is logged and the base lexicon is used)
+@functools.lru_cache(maxsize=8)
+def get_confirm_classifier(lexicon_json="{}"):
+    try:
+        lexicon = merge_lexicons(CONFIRM_LEXICON, json.loads(lexicon_json or "{}"))
+    except (ValueError, TypeError, AttributeError) as e:
+        log.error(f"Invalid confirm lexicon setting, using the base lexicon: {e}")
+        lexicon = CONFIRM_LEXICON
+    return ConfirmClassifier(lexicon)
@@ -0,0 +1,164 @@
+from langchain.embeddings.base import Embeddings
+from collections import OrderedDict
+from array import array
+from cat.log import log
+from .cform_trace import tracer
+import threading
+import hashlib
+import sqlite3
+import os
+
+
+# Get the embedder identity (class and model name)
+def embedder_id(embedder):
+    if isinstance(embedder, CachedEmbedder):
+        return embedder.id
+    model = getattr(embedder, "model", None) or getattr(embedder, "model_name", None) or ""
+    return f"{type(embedder).__module__}.{type(embedder).__name__}:{model}"
+
+
+# Normalize a text before using it as cache key
+def normalize_text(text):
+    return " ".join(str(text).split()).casefold()
+
+
+# Embeddings on-disk tier (sqlite)
+class DiskEmbeddingStore():
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self.connection.commit()
+
+    # Get a vector (None if not present)
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        vector = array("f")
+        vector.frombytes(row[0])
+        return vector.tolist()
+
+    # Save a list of (key, vector)
+    def put_many(self, items):
+        rows = [(key, array("f", vector).tobytes()) for key, vector in items]
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self.connection.commit()
+
+
+# Embedder with a bounded in-memory LRU cache and an optional on-disk tier
+class CachedEmbedder(Embeddings):
+
+    def __init__(self, embedder, max_size=4096, path=None):
+        self.embedder = embedder
+        self.id       = embedder_id(embedder)
+        self.max_size = max_size
+        self.disk     = DiskEmbeddingStore(path) if path else None
+        self.lock     = threading.Lock()
+        self.memory   = OrderedDict()
+
+        self.hits      = 0
+        self.disk_hits = 0
+        self.misses    = 0
+
+    # Get the cache key of a text
+    def key(self, text):
+        return hashlib.sha1(f"{self.id}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    # Embed a single text
+    def embed_query(self, text):
+        return self.embed_documents([text], query=True)[0]
+
+    # Embed a list of texts (only the texts not present in the cache are sent to the embedder)
+    def embed_documents(self, texts, query=False):
+        keys    = [self.key(text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = OrderedDict()
+
+        # Memory tier
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    vectors[i] = self.memory[key]
+                    self.hits += 1
+
+        # Disk tier
+        for i, key in enumerate(keys):
+            if vectors[i] is not None:
+                continue
+            vector = self.disk.get(key) if self.disk else None
+            if vector is not None:
+                vectors[i] = vector
+                self._remember(key, vector)
+                self.disk_hits += 1
+            else:
+                missing.setdefault(key, []).append(i)
+
+        # Embedder
+        if missing:
+            self.misses += len(missing)
+            missing_texts = [texts[indexes[0]] for indexes in missing.values()]
+            tracer.count(embedding_calls=1, embedded_texts=len(missing_texts))
+            if query and len(missing_texts) == 1:
+                new_vectors = [self.embedder.embed_query(missing_texts[0])]
+            else:
+                new_vectors = self.embedder.embed_documents(missing_texts)
+
+            for (key, indexes), vector in zip(missing.items(), new_vectors):
+                for i in indexes:
+                    vectors[i] = vector
+                self._remember(key, vector)
+            if self.disk:
+                self.disk.put_many(zip(missing.keys(), new_vectors))
+
+        return vectors
+
+    # Add a vector to the memory tier (evicting the least recently used)
+    def _remember(self, key, vector):
+        with self.lock:
+            self.memory[key] = vector
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_size:
+                self.memory.popitem(last=False)
+
+    # Get hit-rate counters
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size":      len(self.memory),
+            "max_size":  self.max_size,
+            "hits":      self.hits,
+            "disk_hits": self.disk_hits,
+            "misses":    self.misses,
+            "hit_rate":  (self.hits + self.disk_hits) / lookups if lookups else 0.0
+        }
+
+
+# Cached embedders (one for each cat embedder)
+_cached_embedders = {}
+_cached_embedders_lock = threading.Lock()
+
+# Get the cached embedder wrapping the cat embedder
+def get_cached_embedder(cat, settings):
+    max_size = int(settings.get("embedding_cache_size", 4096))
+    path     = settings.get("embedding_cache_path") or None
+    embedder = cat.embedder
+
+    cached = _cached_embedders.get(id(embedder))
+    if cached and cached.embedder is embedder and cached.max_size == max_size and \
+        (cached.disk.path if cached.disk else None) == path:
+        return cached
+
+    with _cached_embedders_lock:
+        cached = CachedEmbedder(embedder, max_size=max_size, path=path)
+        _cached_embedders[id(embedder)] = cached
+        log.info(f"Embedding cache created for {cached.id} (size: {max_size}, path: {path})")
+        return cached
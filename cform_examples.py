@@ -0,0 +1,86 @@
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, VectorParams
+from langchain.prompts.example_selector import SemanticSimilarityExampleSelector
+from langchain.prompts.example_selector.semantic_similarity import sorted_values
+from langchain.vectorstores import Qdrant
+from cat.log import log
+from .cform_embedder import embedder_id
+import threading
+import hashlib
+import json
+
+
+# Few-shot example indexes
+# (one index for each model class, shared by all sessions and rebuilt only when the examples or the embedder change)
+class ExampleIndexes():
+
+    _indexes = {}
+    _clients = {}
+    _lock = threading.Lock()
+
+    # Get the fingerprint of the examples for an embedder
+    @classmethod
+    def fingerprint(cls, examples, embedder):
+        data = json.dumps({"embedder": embedder_id(embedder), "examples": examples}, sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    # Get the example selector of a model class
+    @classmethod
+    def get(cls, model_class, examples, embedder, path=None):
+        fingerprint = cls.fingerprint(examples, embedder)
+        key = (model_class, path)
+
+        index = cls._indexes.get(key)
+        if index and index[0] == fingerprint:
+            return index[1]
+
+        with cls._lock:
+            index = cls._indexes.get(key)
+            if index and index[0] == fingerprint:
+                return index[1]
+
+            collection_name = f"{model_class.__name__.lower()}_examples_{fingerprint[:16]}"
+            if path:
+                selector = cls._load_persistent(collection_name, examples, embedder, path)
+            else:
+                log.info(f"Build example index {collection_name}")
+                selector = SemanticSimilarityExampleSelector.from_examples(
+                    examples, embedder, Qdrant, k=1, location=':memory:', collection_name=collection_name
+                )
+
+            cls._indexes[key] = (fingerprint, selector)
+            return selector
+
+    # Get the example selector from the on-disk index (the index is built if it does not exist)
+    @classmethod
+    def _load_persistent(cls, collection_name, examples, embedder, path):
+
+        # Local qdrant allows a single client for each path
+        if path not in cls._clients:
+            cls._clients[path] = QdrantClient(path=path)
+        client = cls._clients[path]
+
+        vectorstore = Qdrant(client=client, collection_name=collection_name, embeddings=embedder)
+
+        # Reuse the index saved by a previous process
+        existing = [collection.name for collection in client.get_collections().collections]
+        if collection_name in existing and client.count(collection_name).count == len(examples):
+            log.info(f"Load example index {collection_name}")
+            return SemanticSimilarityExampleSelector(vectorstore=vectorstore, k=1)
+
+        # Remove the indexes of the previous examples
+        prefix = collection_name[:collection_name.rindex("_") + 1]
+        for name in existing:
+            if name.startswith(prefix):
+                client.delete_collection(name)
+
+        # Build the index
+        log.info(f"Build example index {collection_name}")
+        texts = [" ".join(sorted_values(example)) for example in examples]
+        vectors = embedder.embed_documents(texts)
+        client.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(size=len(vectors[0]), distance=Distance.COSINE)
+        )
+        vectorstore.add_texts(texts, metadatas=examples)
+        return SemanticSimilarityExampleSelector(vectorstore=vectorstore, k=1)
@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+from cat.log import log
+from .cform_trace import tracer
+import threading
+import time
+
+
+# Turn executor
+# (runs the independent phases of a turn concurrently on a shared thread pool)
+class TurnExecutor():
+
+    max_workers = 32
+
+    _pool = None
+    _lock = threading.Lock()
+
+    # Get the shared thread pool
+    @classmethod
+    def pool(cls):
+        if cls._pool is None:
+            with cls._lock:
+                if cls._pool is None:
+                    cls._pool = ThreadPoolExecutor(max_workers=cls.max_workers, thread_name_prefix="cform")
+        return cls._pool
+
+    # Run the phases concurrently and return their results
+    # (when the result of the first phase satisfies stop_if, the other phases are cancelled or discarded;
+    # the phases are traced as children of the current span)
+    @classmethod
+    def run(cls, phases, first=None, stop_if=None):
+        start = time.perf_counter()
+        parent = tracer.current()
+        futures = {name: cls.pool().submit(tracer.run_in, parent, fn) for name, fn in phases.items()}
+
+        if first in futures:
+            first_result = futures[first].result()
+            if stop_if is not None and stop_if(first_result):
+                for name, future in futures.items():
+                    if name != first:
+                        future.cancel()
+                log.debug(f"Turn phases stopped by {first} ({time.perf_counter() - start:.3f}s)")
+                return {first: first_result}
+
+        results = {name: future.result() for name, future in futures.items()}
+        log.debug(f"Turn phases {list(results.keys())} ({time.perf_counter() - start:.3f}s)")
+        return results
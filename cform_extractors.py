@@ -0,0 +1,85 @@
+import re
+
+
+# Field extractor
+# (fast local extractor attached to a CBaseModel field with Annotated, e.g. phone: Annotated[str, Regex(r"\d+")])
+class FieldExtractor():
+
+    # Extract the field value from the user message (None if not found)
+    def extract(self, text):
+        return None
+
+
+# Regex field extractor
+class Regex(FieldExtractor):
+
+    def __init__(self, pattern, group=0, flags=re.IGNORECASE, normalize=None):
+        self.pattern   = re.compile(pattern, flags)
+        self.group     = group
+        self.normalize = normalize
+
+    def extract(self, text):
+        match = self.pattern.search(text)
+        if match is None:
+            return None
+        value = match.group(self.group).strip()
+        if self.normalize:
+            value = self.normalize(value)
+        return value or None
+
+
+# Lookup field extractor
+# (returns the value of the list found in the user message; None if different values are found,
+# e.g. "no Margherita, I want a Diavola", the values contained in a longer match are not counted)
+class Lookup(FieldExtractor):
+
+    def __init__(self, values, case_sensitive=False):
+        self.values = sorted(values, key=len, reverse=True)
+        flags = 0 if case_sensitive else re.IGNORECASE
+        self.patterns = [
+            (value, re.compile(r"(?<!\w)" + r"\s+".join(map(re.escape, value.split())) + r"(?!\w)", flags))
+            for value in self.values
+        ]
+
+    def extract(self, text):
+        found = []
+        for value, pattern in self.patterns:
+            for match in pattern.finditer(text):
+                if not any(start <= match.start() and match.end() <= end for _, start, end in found):
+                    found.append((value, match.start(), match.end()))
+        values = {value for value, _, _ in found}
+        if len(values) != 1:
+            return None
+        return values.pop()
+
+
+# Custom field extractor (a callable that receives the user message)
+class Custom(FieldExtractor):
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def extract(self, text):
+        return self.fn(text)
+
+
+# Get the extractors of each field of a model class
+def get_field_extractors(model_class):
+    extractors = {}
+    for name, field in model_class.model_fields.items():
+        field_extractors = [metadata for metadata in field.metadata if isinstance(metadata, FieldExtractor)]
+        if field_extractors:
+            extractors[name] = field_extractors
+    return extractors
+
+
+# Run the extractors on the user message, return the extracted values
+def extract_fields(extractors, text):
+    values = {}
+    for name, field_extractors in extractors.items():
+        for extractor in field_extractors:
+            value = extractor.extract(text)
+            if value not in [None, ""]:
+                values[name] = value
+                break
+    return values
@@ -0,0 +1,114 @@
+from cat.log import log
+from .cform_embedder import embedder_id
+import threading
+import math
+import re
+
+
+# Strip the final punctuation of a sentence
+def strip_sentence(text):
+    return text.strip().rstrip(".,;:!? ").strip()
+
+
+# Get the shape of a value (numbers and text values never match each other)
+def value_shape(value):
+    return "number" if re.fullmatch(r"[\d\s+\-().]+", value) else "text"
+
+
+# Get the longest value accepted for a field example value
+# (the capture group is not bounded: a longer value usually swallows the rest of the message)
+def max_value_length(value):
+    return max(2 * len(value), len(value) + 10)
+
+
+# Build the template of a field example
+# (the example utterance with its value replaced by a capture group, None if the value is not in the utterance)
+def build_template(utterance, value):
+    utterance = strip_sentence(utterance)
+    value = str(value).strip()
+    start = utterance.lower().find(value.lower())
+    if not value or start < 0:
+        return None
+
+    def words(text):
+        return r"\s*".join(r"\s+".join(map(re.escape, part.split())) for part in text.split(","))
+
+    prefix = words(utterance[:start].strip())
+    suffix = words(utterance[start + len(value):].strip())
+    prefix = rf"{prefix}\s+" if prefix else ""
+    suffix = rf"\s+{suffix}" if suffix else ""
+    return re.compile(rf"^\s*{prefix}(?P<value>.+?){suffix}\s*$", re.IGNORECASE)
+
+
+# Cosine similarity
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+# Field example index
+# (the (utterance, value) pairs declared in Field(examples=[...]) of each field)
+class FieldExampleIndex():
+
+    def __init__(self, model_class, embedder):
+        self.entries = []
+        utterances = []
+        for name, field in model_class.model_fields.items():
+            for example in field.examples or []:
+                if not isinstance(example, (tuple, list)) or len(example) != 2:
+                    continue
+                utterance, value = example
+                template = build_template(utterance, value)
+                if template is not None:
+                    self.entries.append((name, template, value_shape(str(value)), max_value_length(str(value).strip())))
+                    utterances.append(strip_sentence(utterance))
+
+        # Embed the utterances in a single batch
+        self.vectors = embedder.embed_documents(utterances) if utterances else []
+
+    # Fill the fields whose examples are similar to the user message and whose template matches it
+    # (the values much longer than the example value, or containing the value of another field, are rejected)
+    def match(self, message, message_vector, threshold):
+        message = strip_sentence(message)
+        scored = sorted(
+            ((cosine(message_vector, vector), entry) for entry, vector in zip(self.entries, self.vectors)),
+            key=lambda item: item[0],
+            reverse=True
+        )
+
+        details = {}
+        for score, (name, template, shape, max_length) in scored:
+            if score < threshold:
+                break
+            if name in details:
+                continue
+            match = template.match(message)
+            if match and value_shape(match.group("value")) == shape and len(match.group("value")) <= max_length:
+                details[name] = match.group("value")
+                log.debug(f"field example match: {name}={details[name]} (score: {score:.3f})")
+
+        # A value that contains the value of another field spans both of them
+        return {
+            name: value for name, value in details.items()
+            if not any(other != name and other_value.lower() in value.lower() for other, other_value in details.items())
+        }
+
+
+# Field example indexes registry (one index for each model class and embedder)
+class FieldExampleIndexes():
+
+    _indexes = {}
+    _lock = threading.Lock()
+
+    # Get the field example index of a model class
+    @classmethod
+    def get(cls, model_class, embedder):
+        key = (model_class, embedder_id(embedder))
+        index = cls._indexes.get(key)
+        if index is not None:
+            return index
+        with cls._lock:
+            if key not in cls._indexes:
+                cls._indexes[key] = FieldExampleIndex(model_class, embedder)
+            return cls._indexes[key]
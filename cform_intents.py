@@ -0,0 +1,261 @@
+from qdrant_client.http.models import Distance, VectorParams, PointStruct, SearchRequest, Filter, FieldCondition, MatchValue
+from qdrant_client.http.models import CreateAliasOperation, CreateAlias, DeleteAliasOperation, DeleteAlias
+from cat.log import log
+from .cform_embedder import embedder_id
+import threading
+import time
+import uuid
+import hashlib
+import json
+
+
+# User confirm examples
+CONFIRM_EXAMPLES = [
+    {"message": "yes, they are correct",   "label": "True" },
+    {"message": "ok, they are fine",       "label": "True" },
+    {"message": "they seem right",         "label": "True" },
+    {"message": "I think so",              "label": "True" },
+    {"message": "no, we are not there",    "label": "False"},
+    {"message": "wrong",                   "label": "False"},
+    {"message": "they are not correct",    "label": "False"},
+    {"message": "I don't think so",        "label": "False"}
+]
+
+# Exit intent examples (the False examples are the messages that continue the form)
+EXIT_INTENT_EXAMPLES = [
+    {"message": "I would like to exit the module",                    "label": "True" },
+    {"message": "I no longer want to continue filling out the form",  "label": "True" },
+    {"message": "You go out",                                         "label": "True" },
+    {"message": "Return to normal conversation",                      "label": "True" },
+    {"message": "Stop and go out",                                    "label": "True" },
+    {"message": "I would like to continue",                           "label": "False"},
+    {"message": "I want to change a value",                           "label": "False"},
+    {"message": "what data do you still need?",                       "label": "False"},
+    {"message": "my name is Mario Rossi",                             "label": "False"},
+    {"message": "yes, they are correct",                              "label": "False"},
+    {"message": "no, they are not correct",                           "label": "False"}
+]
+
+# Intent collection name (confirm and exit examples, told apart by the intent payload field)
+INTENT_COLLECTION = "cform_intents"
+
+
+# Get the examples of the intent collection
+def intent_examples():
+    return [dict(example, intent="confirm") for example in CONFIRM_EXAMPLES] \
+         + [dict(example, intent="exit") for example in EXIT_INTENT_EXAMPLES]
+
+
+# Get the label voted by the nearest examples
+# (each result with a score above the threshold votes for its label with its score; None if no result votes)
+def vote(search_results, threshold):
+    votes = {}
+    for result in search_results:
+        if result.score >= threshold:
+            label = result.payload.get("label", "True")
+            votes[label] = votes.get(label, 0.0) + result.score
+    if not votes:
+        return None
+    return max(votes, key=votes.get)
+
+
+# Search the nearest examples of several intents with a single batched request
+# (limits maps each intent to the number of neighbours; return the results of each intent)
+def search_intents(qclient, collection_name, vector, limits):
+    intents = list(limits.keys())
+    requests = [
+        SearchRequest(
+            vector=vector,
+            filter=Filter(must=[FieldCondition(key="intent", match=MatchValue(value=intent))]),
+            limit=limits[intent],
+            with_payload=True
+        )
+        for intent in intents
+    ]
+    batch_results = qclient.search_batch(collection_name=collection_name, requests=requests)
+    return dict(zip(intents, batch_results))
+
+
+# Collections of the previous versions of the plugin (dropped on the first refresh)
+LEGACY_COLLECTIONS = ["user_confirm", "exit_intent"]
+
+
+# Intent collections registry
+# (each example set is built in a new versioned collection, named after its fingerprint, build time and a nonce,
+# and published through an alias: the readers search the alias and never see a missing or half-filled collection.
+# The collections are built only by the explicit refresh (at bootstrap); the previous generation is kept
+# for the searches still running on it)
+class IntentCollections():
+
+    _fingerprints = {}
+    _refreshed = set()
+    _lock = threading.Lock()
+    _refresh_lock = threading.Lock()
+
+    # Get the fingerprint of an example set for an embedder
+    @classmethod
+    def fingerprint(cls, examples, embedder):
+        data = json.dumps({"embedder": embedder_id(embedder), "examples": examples}, sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    # Get a new versioned collection name (unique even when several workers build the same fingerprint)
+    @classmethod
+    def versioned_name(cls, alias_name, fingerprint):
+        return f"{alias_name}__{fingerprint[:16]}_{time.time_ns() // 1000}_{uuid.uuid4().hex[:8]}"
+
+    # Get the fingerprint and the build time of a versioned collection name (None, 0 if it is not one)
+    @classmethod
+    def generation(cls, alias_name, collection_name):
+        if collection_name is None or not collection_name.startswith(f"{alias_name}__"):
+            return None, 0
+        parts = collection_name[len(alias_name) + 2:].split("_")
+        if len(parts) != 3 or not parts[1].isdigit():
+            return parts[0], 0
+        return parts[0], int(parts[1])
+
+    # Get the alias of a published example set (None if no collection is published for it)
+    # (the alias is served only if it points to a generation of these examples and this embedder:
+    # otherwise the examples are refreshed once, and None is returned until the refresh has published them)
+    @classmethod
+    def published(cls, qclient, embedder, alias_name, examples):
+        fingerprint = cls.fingerprint(examples, embedder)
+        registry_key = (id(qclient), alias_name)
+        if cls._fingerprints.get(registry_key) == fingerprint:
+            return alias_name
+
+        if cls._is_published(qclient, alias_name, fingerprint):
+            with cls._lock:
+                cls._fingerprints[registry_key] = fingerprint
+            return alias_name
+
+        # Refresh the examples once (a failed or concurrent refresh falls back to None)
+        with cls._lock:
+            attempted = (registry_key, fingerprint) in cls._refreshed
+            cls._refreshed.add((registry_key, fingerprint))
+        if not attempted:
+            log.warning(f"Intent collection {alias_name} is missing or stale, refresh it")
+            try:
+                cls.refresh(qclient, embedder, alias_name, examples)
+            except Exception as e:
+                log.error(f"Intent collection {alias_name} refresh failed: {e}")
+
+        if cls._is_published(qclient, alias_name, fingerprint):
+            with cls._lock:
+                cls._fingerprints[registry_key] = fingerprint
+            return alias_name
+        return None
+
+    # Get the fingerprint of the examples published through an alias (None if not published)
+    @classmethod
+    def published_fingerprint(cls, qclient, alias_name):
+        return cls._fingerprints.get((id(qclient), alias_name))
+
+    # Build the examples in a new versioned collection and switch the alias to it
+    # (the refreshes of a process are serialized; the alias is switched only if it still points
+    # to the collection it pointed to before the build, otherwise another worker has refreshed it)
+    @classmethod
+    def refresh(cls, qclient, embedder, alias_name, examples):
+        fingerprint = cls.fingerprint(examples, embedder)
+        registry_key = (id(qclient), alias_name)
+
+        with cls._refresh_lock:
+            previous_name = cls._alias_target(qclient, alias_name)
+            if cls.generation(alias_name, previous_name)[0] == fingerprint[:16]:
+                with cls._lock:
+                    cls._fingerprints[registry_key] = fingerprint
+                return alias_name
+
+            collection_name = cls.versioned_name(alias_name, fingerprint)
+            cls._build(qclient, embedder, collection_name, examples, fingerprint)
+
+            # Switch the alias only if nobody has switched it during the build
+            current_name = cls._alias_target(qclient, alias_name)
+            if current_name != previous_name:
+                log.info(f"Intent collection alias {alias_name} switched by another worker to {current_name}")
+                qclient.delete_collection(collection_name)
+                return alias_name
+
+            log.info(f"Switch intent collection alias {alias_name}: {previous_name} -> {collection_name}")
+            cls._drop_legacy(qclient, alias_name)
+            operations = []
+            if previous_name is not None:
+                operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias_name)))
+            operations.append(CreateAliasOperation(create_alias=CreateAlias(collection_name=collection_name, alias_name=alias_name)))
+            qclient.update_collection_aliases(change_aliases_operations=operations)
+
+            cls._drop_old_generations(qclient, alias_name, previous_name)
+
+        with cls._lock:
+            cls._fingerprints[registry_key] = fingerprint
+        return alias_name
+
+    # Check that an alias points to a generation of a fingerprint
+    @classmethod
+    def _is_published(cls, qclient, alias_name, fingerprint):
+        return cls.generation(alias_name, cls._alias_target(qclient, alias_name))[0] == fingerprint[:16]
+
+    # Get the collection an alias points to (None if the alias does not exist)
+    @classmethod
+    def _alias_target(cls, qclient, alias_name):
+        try:
+            aliases = qclient.get_aliases().aliases
+        except Exception:
+            return None
+        return next((alias.collection_name for alias in aliases if alias.alias_name == alias_name), None)
+
+    # Get the names of the collections
+    @classmethod
+    def _collection_names(cls, qclient):
+        return [collection.name for collection in qclient.get_collections().collections]
+
+    # Drop the legacy collections (a collection with the alias name would prevent the alias creation)
+    @classmethod
+    def _drop_legacy(cls, qclient, alias_name):
+        names = cls._collection_names(qclient)
+        for legacy_name in [alias_name] + LEGACY_COLLECTIONS:
+            if legacy_name in names:
+                log.info(f"Drop legacy intent collection {legacy_name}")
+                qclient.delete_collection(legacy_name)
+
+    # Drop the generations of an alias built before the previous one
+    # (the newer collections may be builds of other workers still in progress)
+    @classmethod
+    def _drop_old_generations(cls, qclient, alias_name, previous_name):
+        if previous_name is None:
+            return
+        previous_time = cls.generation(alias_name, previous_name)[1]
+        for name in cls._collection_names(qclient):
+            fingerprint, build_time = cls.generation(alias_name, name)
+            if fingerprint is not None and name != previous_name and build_time < previous_time:
+                log.info(f"Drop old intent collection {name}")
+                qclient.delete_collection(name)
+
+    # Create the versioned collection and insert the examples
+    @classmethod
+    def _build(cls, qclient, embedder, collection_name, examples, fingerprint):
+        log.info(f"Build intent collection {collection_name}")
+
+        # Embed all the examples in a single batch
+        vectors = embedder.embed_documents([data["message"] for data in examples])
+
+        # Create collection (the name is new: an existing collection is never replaced)
+        qclient.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(
+                size=len(vectors[0]),
+                distance=Distance.COSINE
+            )
+        )
+
+        # Insert training data into index
+        points = []
+        for i, (data, vector) in enumerate(zip(examples, vectors)):
+            payload = {key: value for key, value in data.items() if key != "message"}
+            payload["fingerprint"] = fingerprint
+            points.append(PointStruct(id=i, vector=vector, payload=payload))
+
+        qclient.upsert(
+            collection_name=collection_name,
+            wait=True,
+            points=points,
+        )
@@ -0,0 +1,144 @@
+from collections import Counter
+import threading
+import math
+import re
+
+
+# Language names
+LANGUAGE_NAMES = {
+    "en": "English",
+    "it": "Italian",
+    "fr": "French",
+    "es": "Spanish",
+    "de": "German",
+    "pt": "Portuguese"
+}
+
+# Training texts for the character n-gram profiles
+LANGUAGE_SAMPLES = {
+    "en": "hello how are you I would like to order a pizza please. my address is the main street and my phone number is \
+        the following. I want to register for the service, my name is John and I work for a company. thank you very much, \
+        yes that is correct, no that is wrong. what is on the menu? which types of pizza do you have? can you tell me \
+        where you live and when you want the delivery? I think so, they seem right, I don't want to continue with this \
+        order anymore. we are going to the office today with the other people of the team, it is a good day for a walk. \
+        the weather is nice and there is something that we should do together before the evening",
+    "it": "ciao come stai vorrei ordinare una pizza per favore. il mio indirizzo è via roma e il mio numero di telefono è \
+        il seguente. voglio registrarmi al servizio, mi chiamo giovanni e lavoro per una azienda. grazie mille, sì sono \
+        corretti, no non sono giusti. cosa c'è nel menu? quali tipi di pizza avete? mi puoi dire dove abiti e quando vuoi \
+        la consegna? penso di sì, sembrano giusti, non voglio più continuare con questo ordine. oggi andiamo in ufficio \
+        con gli altri della squadra, è una bella giornata per una passeggiata. il tempo è bello e c'è qualcosa che \
+        dovremmo fare insieme prima della sera, buongiorno buonasera",
+    "fr": "bonjour comment allez vous je voudrais commander une pizza s'il vous plaît. mon adresse est la rue principale \
+        et mon numéro de téléphone est le suivant. je veux m'inscrire au service, je m'appelle jean et je travaille pour \
+        une entreprise. merci beaucoup, oui c'est correct, non c'est faux. qu'est-ce qu'il y a au menu? quels types de \
+        pizza avez-vous? pouvez-vous me dire où vous habitez et quand vous voulez la livraison? je pense que oui, je ne \
+        veux plus continuer cette commande. aujourd'hui nous allons au bureau avec les autres de l'équipe, c'est une \
+        belle journée pour une promenade. il fait beau et il y a quelque chose que nous devrions faire ensemble avant le soir",
+    "es": "hola cómo estás quisiera pedir una pizza por favor. mi dirección es la calle mayor y mi número de teléfono es \
+        el siguiente. quiero registrarme en el servicio, me llamo juan y trabajo para una empresa. muchas gracias, sí \
+        son correctos, no están mal. qué hay en el menú? qué tipos de pizza tienen? me puedes decir dónde vives y cuándo \
+        quieres la entrega? creo que sí, parecen correctos, ya no quiero continuar con este pedido. hoy vamos a la \
+        oficina con los demás del equipo, es un buen día para un paseo. hace buen tiempo y hay algo que deberíamos \
+        hacer juntos antes de la noche, buenos días buenas tardes",
+    "de": "hallo wie geht es dir ich möchte bitte eine pizza bestellen. meine adresse ist die hauptstraße und meine \
+        telefonnummer ist die folgende. ich möchte mich für den dienst registrieren, ich heiße johann und arbeite für \
+        eine firma. vielen dank, ja das ist richtig, nein das ist falsch. was steht auf der speisekarte? welche sorten \
+        pizza haben sie? kannst du mir sagen wo du wohnst und wann du die lieferung willst? ich glaube schon, ich \
+        möchte diese bestellung nicht mehr fortsetzen. heute gehen wir mit den anderen aus dem team ins büro, es ist \
+        ein schöner tag für einen spaziergang. das wetter ist schön und es gibt etwas das wir vor dem abend zusammen \
+        machen sollten, guten tag guten abend",
+    "pt": "olá como vai você eu gostaria de pedir uma pizza por favor. o meu endereço é a rua principal e o meu número \
+        de telefone é o seguinte. quero me registrar no serviço, o meu nome é joão e trabalho para uma empresa. muito \
+        obrigado, sim estão corretos, não estão errados. o que tem no cardápio? quais tipos de pizza vocês têm? pode \
+        me dizer onde você mora e quando quer a entrega? acho que sim, parecem certos, não quero mais continuar com \
+        este pedido. hoje vamos ao escritório com os outros da equipe, é um bom dia para um passeio. o tempo está bom \
+        e há algo que devemos fazer juntos antes da noite, bom dia boa tarde"
+}
+
+# Short words that identify a language on their own
+LANGUAGE_WORDS = {
+    "en": ["hello", "hi", "yes", "no", "the", "and", "is", "my", "i", "you", "want", "thanks", "please", "ok", "with"],
+    "it": ["ciao", "sì", "si", "il", "lo", "gli", "è", "mio", "voglio", "grazie", "vorrei", "buongiorno", "sono", "anche", "con"],
+    "fr": ["bonjour", "salut", "oui", "non", "le", "les", "est", "mon", "je", "veux", "merci", "voudrais", "avec", "tous", "et"],
+    "es": ["hola", "sí", "el", "los", "es", "mi", "yo", "quiero", "gracias", "quisiera", "buenos", "con", "y", "pero", "muy"],
+    "de": ["hallo", "ja", "nein", "der", "die", "das", "ist", "mein", "ich", "will", "danke", "bitte", "möchte", "und", "mit"],
+    "pt": ["olá", "oi", "sim", "não", "o", "os", "é", "meu", "eu", "quero", "obrigado", "gostaria", "com", "e", "muito"]
+}
+
+
+# Local language detector (character n-gram model)
+class LanguageDetector():
+
+    def __init__(self, samples=LANGUAGE_SAMPLES, words=LANGUAGE_WORDS, n=3):
+        self.n = n
+        self.words = {language: set(language_words) for language, language_words in words.items()}
+        self.profiles = {}
+        self.unknown  = {}
+        for language, text in samples.items():
+            ngrams = Counter(self.ngrams(text))
+            total = sum(ngrams.values()) + len(ngrams) + 1
+            self.profiles[language] = {ngram: math.log((count + 1) / total) for ngram, count in ngrams.items()}
+            self.unknown[language]  = math.log(1 / total)
+
+    # Split a text in lowercase words
+    def tokenize(self, text):
+        return re.findall(r"[^\W\d_]+(?:'[^\W\d_]+)?", text.lower())
+
+    # Get the character n-grams of a text
+    def ngrams(self, text):
+        ngrams = []
+        for word in self.tokenize(text):
+            word = f" {word} "
+            ngrams.extend(word[i:i + self.n] for i in range(max(1, len(word) - self.n + 1)))
+        return ngrams
+
+    # Detect the language of a text, return (language code, confidence)
+    def detect(self, text):
+        ngrams = self.ngrams(text)
+        if not ngrams:
+            return None, 0.0
+
+        # Log-likelihood of the n-grams (plus a bonus for the identifying words)
+        tokens = self.tokenize(text)
+        scores = {}
+        for language, profile in self.profiles.items():
+            unknown = self.unknown[language]
+            score = sum(profile.get(ngram, unknown) for ngram in ngrams)
+            score += 2.0 * sum(1 for token in tokens if token in self.words[language])
+            scores[language] = score
+
+        # Posterior probabilities
+        best = max(scores.values())
+        exp_scores = {language: math.exp(score - best) for language, score in scores.items()}
+        total = sum(exp_scores.values())
+        language = max(exp_scores, key=exp_scores.get)
+        return language, exp_scores[language] / total
+
+
+# Shared detector (built on first use)
+_detector = None
+_detector_lock = threading.Lock()
+
+# Get the shared language detector
+def get_language_detector():
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = LanguageDetector()
+    return _detector
+
+
+# Get the language name of a code
+def language_name(code):
+    return LANGUAGE_NAMES.get(code) or code or "English"
+
+
+# Get the language code of a name (as answered by an LLM)
+# (unknown languages keep their name)
+def language_code(name):
+    name = name.strip().strip("'\".").lower()
+    for code, language in LANGUAGE_NAMES.items():
+        if language.lower() in name:
+            return code
+    return name.title() if name else None
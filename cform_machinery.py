@@ -0,0 +1,116 @@
+from langchain.prompts.few_shot import FewShotPromptTemplate
+from langchain.prompts.prompt import PromptTemplate
+from cat.log import log
+from .cform_compiled import CompiledForms
+from .cform_examples import ExampleIndexes
+from .cform_intents import IntentCollections, INTENT_COLLECTION, intent_examples
+from .cform_embedder import embedder_id
+import threading
+
+
+# Form machinery
+# (compiled schemas, example selector, prompt templates and intent collection of a form class,
+# shared by all its sessions)
+class FormMachinery():
+
+    def __init__(self, model_class, example_selector, intent_collection):
+        self.model_class = model_class
+        self.compiled    = CompiledForms.get(model_class)
+
+        self.example_selector  = example_selector
+        self.intent_collection = intent_collection
+
+        self.prompt_tpl_update   = None
+        self.prompt_tpl_response = None
+        if example_selector is None:
+            return
+
+        # Create example_update_model_prompt for formatting output
+        example_update_model_prompt = PromptTemplate(
+            input_variables = ["user_message", "model_before", "model_after"],
+            template = "User Message: {user_message}\nModel: {model_before}\nUpdated Model: {model_after}"
+        )
+
+        # Create promptTemplate from examples_selector and example_update_model_prompt
+        self.prompt_tpl_update = FewShotPromptTemplate(
+            example_selector = example_selector,
+            example_prompt   = example_update_model_prompt,
+            suffix = "User Message: {user_message}\nModel: {model}\nUpdated Model: ",
+            input_variables = ["user_message", "model"]
+        )
+
+        # Create example_response_prompt for formatting output
+        example_response_prompt = PromptTemplate(
+            input_variables = ["validation", "response"],
+            template = "Message: {validation}\nResponse: {response}"
+        )
+
+        # Create promptTemplate from examples_selector and example_response_prompt
+        self.prompt_tpl_response = FewShotPromptTemplate(
+            example_selector = example_selector,
+            example_prompt   = example_response_prompt,
+            suffix = "Message: {validation}\nResponse: ",
+            input_variables = ["validation"]
+        )
+
+
+# Form machineries registry (one machinery for each form class)
+class FormMachineries():
+
+    _machineries = {}
+    # (form class, embedder id, vector db id) -> (settings snapshot, machinery)
+    _lookups = {}
+    _lock = threading.Lock()
+
+    # Get the machinery of a form class
+    # (looked up once per settings snapshot: the form examples must depend only on the settings;
+    # the lookup is repeated while the intent collection is not published)
+    @classmethod
+    def get(cls, model_class, cat, embedder, settings):
+        qclient = cat.memory.vectors.vector_db
+        lookup_key = (model_class, embedder_id(embedder), id(qclient))
+        lookup = cls._lookups.get(lookup_key)
+        if lookup is not None and lookup[0] is settings:
+            return lookup[1]
+
+        machinery = cls._lookup(model_class, cat, embedder, settings)
+        if machinery.intent_collection is not None:
+            with cls._lock:
+                cls._lookups[lookup_key] = (settings, machinery)
+        return machinery
+
+    # Get the machinery of a form class from its examples and the published intent collection
+    # (rebuilt only when the example selector or the intent collection change)
+    @classmethod
+    def _lookup(cls, model_class, cat, embedder, settings):
+
+        # Example selector (None if the form has no examples)
+        examples = model_class.model_construct().examples(cat)
+        example_selector = None
+        if examples:
+            example_selector = ExampleIndexes.get(
+                model_class, examples, embedder, settings.get("examples_index_path") or None
+            )
+
+        # Intent collection (confirm and exit examples; None while no collection is published for this embedder)
+        qclient = cat.memory.vectors.vector_db
+        intent_collection = IntentCollections.published(qclient, embedder, INTENT_COLLECTION, intent_examples())
+
+        machinery = cls._machineries.get(model_class)
+        if cls._is_current(machinery, example_selector, intent_collection):
+            return machinery
+
+        with cls._lock:
+            machinery = cls._machineries.get(model_class)
+            if not cls._is_current(machinery, example_selector, intent_collection):
+                log.info(f"Build form machinery {model_class.__name__}")
+                machinery = FormMachinery(model_class, example_selector, intent_collection)
+                cls._machineries[model_class] = machinery
+            return machinery
+
+    # Check that a machinery uses the given selector and collection
+    @classmethod
+    def _is_current(cls, machinery, example_selector, intent_collection):
+        return machinery is not None \
+            and machinery.example_selector is example_selector \
+            and machinery.intent_collection == intent_collection
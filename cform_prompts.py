@@ -0,0 +1,216 @@
+from cat.log import log
+from .cform_trace import tracer
+import json
+import re
+
+
+##########################
+######## TOKENIZER #######
+##########################
+
+# Count the tokens of a text (approximation: words, punctuation marks and runs of whitespace)
+def approximate_tokens(text):
+    return len(re.findall(r"\w+|[^\w\s]|\s{2,}", text))
+
+
+# Get the tiktoken counter (None if tiktoken or its encoding are not available)
+def tiktoken_counter(encoding="cl100k_base"):
+    try:
+        import tiktoken
+        encoder = tiktoken.get_encoding(encoding)
+    except Exception as e:
+        log.info(f"tiktoken not available, the prompt tokens are approximated ({e})")
+        return None
+    return lambda text: len(encoder.encode(text))
+
+
+_count_tokens = None
+
+# Set the function used to count the tokens
+def set_tokenizer(count_tokens):
+    global _count_tokens
+    _count_tokens = count_tokens
+
+# Count the tokens of a text
+# (with tiktoken if available, loaded on first use)
+def count_tokens(text):
+    if _count_tokens is None:
+        set_tokenizer(tiktoken_counter() or approximate_tokens)
+    return _count_tokens(text)
+
+
+###########################
+######## COMPACTION #######
+###########################
+
+# Normalize the whitespace of a template
+# (each line is stripped and its spaces collapsed, consecutive blank lines are merged)
+def compact_text(text):
+    lines = [" ".join(line.split()) for line in text.strip().splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+
+
+# Serialize a value for a prompt (json without spaces for dicts and lists)
+def compact_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+    if value is None:
+        return ""
+    return str(value)
+
+
+########################
+######## PROMPT ########
+########################
+
+# Prompt
+# (the template is compacted once; the few-shot examples are trimmed first to respect the token budget)
+class Prompt():
+
+    example_separator = "\n\n"
+
+    def __init__(self, name, template):
+        self.name     = name
+        self.template = compact_text(template)
+        self.template_tokens_saved = None
+        self._raw_template = template
+
+    # Render the prompt
+    # (examples is the list of formatted few-shot examples, the most relevant first; budget 0 is no limit)
+    def render(self, examples=None, budget=0, **values):
+        values   = {key: compact_value(value) for key, value in values.items()}
+        examples = list(examples or [])
+
+        text   = self._format(examples, values)
+        tokens = count_tokens(text)
+
+        # Trim the least relevant examples
+        trimmed = 0
+        while budget and tokens > budget and examples:
+            examples.pop()
+            trimmed_text = self._format(examples, values)
+            trimmed_tokens = count_tokens(trimmed_text)
+            trimmed += tokens - trimmed_tokens
+            text, tokens = trimmed_text, trimmed_tokens
+        if budget and tokens > budget:
+            log.warning(f"Prompt {self.name} exceeds the token budget ({tokens} > {budget})")
+
+        # Tokens saved by the template compaction (counted once)
+        if self.template_tokens_saved is None:
+            self.template_tokens_saved = count_tokens(self._raw_template) - count_tokens(self.template)
+
+        saved = self.template_tokens_saved + trimmed
+        tracer.count(prompt_tokens=tokens, prompt_tokens_saved=saved)
+        log.debug(f"Prompt {self.name}: {tokens} tokens ({saved} saved, {trimmed} by trimmed examples)")
+        return text
+
+    # Format the template
+    def _format(self, examples, values):
+        text = self.template.format(examples=self.example_separator.join(examples), **values)
+        return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+#########################
+######## PROMPTS ########
+#########################
+
+LANGUAGE_PROMPT = Prompt("language", """
+    Identify the language of the following message and return only the language of the message, without other text.
+    If you can't locate it, return 'English'.
+    Message examples:
+    'Ciao, come stai?', returns: 'Italian',
+    'How do you go?', returns 'English',
+    'Bonjour a tous', returns 'French'
+
+    Message: '{user_message}'
+""")
+
+CONFIRM_PROMPT = Prompt("confirm", """
+    Given a sentence that I will now give you,
+    just respond with 'YES' or 'NO' depending on whether the sentence is:
+    - a refusal either has a negative meaning or is an intention to cancel the form (NO)
+    - an acceptance has a positive or neutral meaning (YES).
+    If you are unsure, answer 'NO'.
+
+    The sentence is as follows:
+    User message: {user_message}
+""")
+
+UPDATE_FROM_EXAMPLES_PROMPT = Prompt("update_from_examples", """
+    Update the following JSON with information extracted from the Sentence:
+
+    {examples}
+
+    {query}
+""")
+
+UPDATE_QUERY_PROMPT = Prompt("update_query", """
+    Sentence: {user_message}
+    JSON:{model}
+    Updated JSON:
+""")
+
+FUSED_PROMPT = Prompt("fused", """
+    Your goal is to have the user fill out a form containing the following fields:
+    {fields}
+
+    you have currently collected the following values:
+    {model}
+
+    {state}.
+
+    Read the user message and answer only with a JSON object with the following keys:
+    - "updates": an object with the field values given or changed in the user message (empty if there are none),
+    - "intent": "confirm" if the user agrees that the collected data is correct, "deny" if the user says it is not correct, "exit" if the user wants to stop filling out the form, "none" otherwise,
+    - "reply": your answer to the user in the {language} language; if some fields are still missing ask for them, if all the fields are collected show them and ask the user to confirm that they are correct, if the user says the data is not correct ask for the updated data.
+
+    User message: {user_message}
+    JSON:
+""")
+
+ASK_MISSING_PROMPT = Prompt("ask_missing", """
+    Your goal is to have the user fill out a form containing the following fields:
+    {fields}
+
+    you have currently collected the following values:
+    {model}
+
+    {errors}
+
+    {ask_for}
+
+    ask the user to give you the necessary information.
+
+    {examples}
+
+    {query}
+""")
+
+SHOW_SUMMARY_PROMPT = Prompt("show_summary", """
+    Your goal is to have the user fill out a form containing the following fields:
+    {fields}
+
+    you have collected all the available data:
+    {model}
+
+    show the user the data and ask them to confirm that it is correct.
+""")
+
+ASK_CHANGE_PROMPT = Prompt("ask_change", """
+    Your goal is to have the user fill out a form containing the following fields:
+    {fields}
+
+    you have collected all the available data:
+    {model}
+
+    show the user the data and ask him to provide the updated data.
+""")
+
+DIALOGUE_PROMPT = Prompt("dialogue", """
+    {prefix}
+
+    Use the {language} language to answer the question.
+
+    User message: {user_message}
+    AI:
+""")
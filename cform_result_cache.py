@@ -0,0 +1,202 @@
+from collections import OrderedDict
+from cat.log import log
+from .cform_embedder import normalize_text
+from .cform_trace import tracer
+import numpy as np
+import threading
+import time
+
+
+# Result cache
+# (results of the classification calls that depend only on the user message, e.g. confirm, language, exit;
+# looked up by normalized text first, then by embedding similarity)
+class ResultCache():
+
+    def __init__(self, max_size=4096, ttl=86400, threshold=0.95):
+        self.max_size  = max_size
+        self.ttl       = ttl
+        self.threshold = threshold
+        self.lock      = threading.Lock()
+
+        # (kind, variant) -> normalized text -> (value, vector, expires)
+        self.entries  = {}
+        # (kind, variant) -> VectorMatrix of the normalized vectors, updated with the entries
+        self.matrices = {}
+        # kind -> hit and miss counters
+        self.counters = {}
+
+    # Update size, ttl and threshold from the settings
+    def configure(self, settings):
+        self.max_size  = int(settings.get("result_cache_size", self.max_size))
+        self.ttl       = float(settings.get("result_cache_ttl", self.ttl))
+        self.threshold = float(settings.get("result_cache_threshold", self.threshold))
+
+    # Get the result of a classification, computing it with fn only if it is not cached
+    # (vector_fn returns the message vector, the similarity lookup is skipped without it;
+    # guard(text, similar_text) can refuse the result of a similar text;
+    # variant separates the results computed with different settings or data, e.g. thresholds)
+    def cached(self, kind, text, fn, vector_fn=None, guard=None, variant=None):
+        key = normalize_text(text)
+        bucket = (kind, variant)
+
+        # Exact lookup
+        found, value = self._get_exact(bucket, key)
+        if found:
+            return self._hit(kind, "exact", value)
+
+        # Similarity lookup
+        vector = None
+        if vector_fn is not None:
+            vector = vector_fn()
+            found, value = self._get_similar(bucket, vector, lambda similar_key: guard is None or guard(key, similar_key))
+            if found:
+                return self._hit(kind, "semantic", value)
+
+        self._count(kind, "misses")
+        tracer.count(result_cache_misses=1)
+        value = fn()
+        self._put(bucket, key, value, vector)
+        return value
+
+    # Get the hit and miss counters of each kind
+    def stats(self):
+        with self.lock:
+            stats = {}
+            for kind, counters in self.counters.items():
+                lookups = counters["exact"] + counters["semantic"] + counters["misses"]
+                stats[kind] = dict(
+                    counters,
+                    size=sum(len(entries) for (entry_kind, _), entries in self.entries.items() if entry_kind == kind),
+                    hit_rate=(counters["exact"] + counters["semantic"]) / lookups if lookups else 0.0
+                )
+            return stats
+
+    # Count a hit
+    def _hit(self, kind, lookup, value):
+        self._count(kind, lookup)
+        tracer.count(result_cache_hits=1)
+        log.debug(f"Result cache {kind} hit ({lookup}): {value}")
+        return value
+
+    # Increment a counter
+    def _count(self, kind, name):
+        with self.lock:
+            counters = self.counters.setdefault(kind, {"exact": 0, "semantic": 0, "misses": 0})
+            counters[name] += 1
+
+    # Get a result by normalized text
+    def _get_exact(self, bucket, key):
+        with self.lock:
+            entries = self.entries.get(bucket)
+            if not entries or key not in entries:
+                return False, None
+            value, vector, expires = entries[key]
+            if expires < time.time():
+                self._delete(bucket, key)
+                return False, None
+            entries.move_to_end(key)
+            return True, value
+
+    # Get the result of the most similar text (above the threshold and accepted by the guard)
+    def _get_similar(self, bucket, vector, accept):
+        with self.lock:
+            matrix = self.matrices.get(bucket)
+            if matrix is None:
+                return False, None
+            key, score = matrix.nearest(vector)
+            entries = self.entries[bucket]
+            if key is None or score < self.threshold or key not in entries:
+                return False, None
+            if entries[key][2] < time.time():
+                self._delete(bucket, key)
+                return False, None
+            if not accept(key):
+                log.debug(f"Result cache {bucket[0]}: similar text refused ({key})")
+                return False, None
+            entries.move_to_end(key)
+            return True, entries[key][0]
+
+    # Save a result (evicting the least recently used; the results of the previous variants of the kind are dropped)
+    def _put(self, bucket, key, value, vector):
+        with self.lock:
+            if bucket not in self.entries:
+                for previous in [previous for previous in self.entries if previous[0] == bucket[0]]:
+                    self.entries.pop(previous)
+                    self.matrices.pop(previous, None)
+            entries = self.entries.setdefault(bucket, OrderedDict())
+            entries[key] = (value, vector, time.time() + self.ttl)
+            entries.move_to_end(key)
+            if vector is not None:
+                self.matrices.setdefault(bucket, VectorMatrix()).add(key, vector)
+            elif bucket in self.matrices:
+                self.matrices[bucket].remove(key)
+            while len(entries) > self.max_size:
+                self._delete(bucket, next(iter(entries)))
+
+    # Delete a result (the lock must be held)
+    def _delete(self, bucket, key):
+        self.entries[bucket].pop(key, None)
+        if bucket in self.matrices:
+            self.matrices[bucket].remove(key)
+
+
+# Matrix of normalized vectors
+# (one row for each key, the rows of the removed keys are reused: adding or removing a vector is O(d))
+class VectorMatrix():
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.matrix   = None
+        self.valid    = np.zeros(capacity, dtype=bool)
+        self.rows     = {}
+        self.keys     = [None] * capacity
+        self.free     = []
+        self.size     = 0
+
+    # Add (or replace) the vector of a key
+    def add(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        if self.matrix is None:
+            self.matrix = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+
+        row = self.rows.get(key)
+        if row is None:
+            row = self.free.pop() if self.free else self._append()
+            self.rows[key] = row
+            self.keys[row] = key
+        self.matrix[row] = vector / (np.linalg.norm(vector) + 1e-12)
+        self.valid[row] = True
+
+    # Remove the vector of a key
+    def remove(self, key):
+        row = self.rows.pop(key, None)
+        if row is not None:
+            self.valid[row] = False
+            self.keys[row] = None
+            self.free.append(row)
+
+    # Get the key of the most similar vector and its score (None if empty)
+    def nearest(self, vector):
+        if not self.rows:
+            return None, 0.0
+        query = np.asarray(vector, dtype=np.float32)
+        scores = self.matrix[:self.size] @ (query / (np.linalg.norm(query) + 1e-12))
+        scores[~self.valid[:self.size]] = -np.inf
+        best = int(np.argmax(scores))
+        return self.keys[best], float(scores[best])
+
+    # Get a new row (the capacity is doubled when full)
+    def _append(self):
+        if self.size == self.capacity:
+            self.capacity *= 2
+            matrix = np.zeros((self.capacity, self.matrix.shape[1]), dtype=np.float32)
+            matrix[:self.size] = self.matrix[:self.size]
+            self.matrix = matrix
+            self.valid  = np.concatenate([self.valid, np.zeros(self.capacity - self.valid.shape[0], dtype=bool)])
+            self.keys.extend([None] * (self.capacity - len(self.keys)))
+        self.size += 1
+        return self.size - 1
+
+
+# Shared result cache
+result_cache = ResultCache()
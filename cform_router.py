@@ -0,0 +1,92 @@
+from cat.log import log
+from .cform_intents import IntentCollections
+from .cform_embedder import get_cached_embedder
+from .cform_session import FormRegistry, registry_name
+from .cform_store import SessionStores
+from .cform_turn import TurnContext
+from .cform_trace import tracer
+
+
+# Fast router
+# (matches the user message with the start and stop examples of every registered form
+# in a single vector search, starting or stopping the form without the agent tool selection)
+class FormRouter():
+
+    collection_name = "form_router"
+
+    # Get the routing examples of the registered forms
+    @classmethod
+    def examples(cls):
+        examples = []
+        for model_class in FormRegistry.models():
+            name = registry_name(model_class)
+            for action, messages in [("start", model_class.start_examples), ("stop", model_class.stop_examples)]:
+                for message in messages:
+                    examples.append({"message": message, "model": name, "action": action})
+        return sorted(examples, key=lambda example: (example["model"], example["action"], example["message"]))
+
+    # Find the form action of the user message (None if no example is similar enough)
+    @classmethod
+    def match(cls, cat, settings):
+        examples = cls.examples()
+        if not examples:
+            return None
+
+        embedder = get_cached_embedder(cat, settings)
+        qclient  = cat.memory.vectors.vector_db
+        collection_name = IntentCollections.published(qclient, embedder, cls.collection_name, examples)
+        if collection_name is None:
+            return None
+
+        # The user message vector is shared with the form checks
+        user_message_vector = TurnContext.current(cat).get("user_message_vector", lambda: embedder.embed_query(
+            cat.working_memory["user_message_json"]["text"]
+        ))
+        search_results = qclient.search(collection_name, user_message_vector, with_payload=True, limit=1)
+        if not search_results:
+            return None
+
+        payload = search_results[0].payload
+        score   = search_results[0].score
+        threshold = settings.get(f"router_{payload['action']}_threshold", 0.85)
+        log.debug(f"form router: {payload['action']} {payload['model']} (score: {score:.3f}, threshold: {threshold})")
+        if score < threshold:
+            return None
+
+        model_class = FormRegistry.model(payload["model"])
+        if model_class is None:
+            return None
+        return payload["action"], model_class
+
+    # Route the user message
+    # (returns the form reply when the message starts or stops a form, None to continue with the normal flow)
+    @classmethod
+    def route(cls, cat, settings):
+        with tracer.span("route") as span:
+            match = cls.match(cat, settings)
+            if match is None:
+                return None
+
+            action, model_class = match
+            key = model_class.__name__
+            active = key in SessionStores.sessions(cat)
+            span.set(action=action, form=key, active=active)
+
+            # Start the form (handing off from any other active form)
+            # (without a direct response the memory chain answers with the form prompt prefix)
+            if action == "start" and not active:
+                if model_class.form_class is not None:
+                    response = model_class.start(cat, form=model_class.form_class)
+                else:
+                    response = model_class.start(cat)
+                if not response:
+                    response = model_class.get(cat).execute_memory_chain()
+                return {"output": response}
+
+            # Stop the form (the memory chain answers without the form prompt prefix)
+            if action == "stop" and active:
+                cform = model_class.get(cat)
+                model_class.stop(cat)
+                return {"output": cform.execute_memory_chain(form_prompt=False)}
+
+            return None
@@ -0,0 +1,76 @@
+import threading
+import json
+
+
+# Get the registry name of a class
+def registry_name(cls):
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+# Form session
+# (the per-user state of an active form; the prompt machinery is shared by the form class)
+class FormSession():
+
+    __slots__ = ("model", "form", "values", "state", "ask_for", "errors", "language")
+
+    def __init__(self, model, form, values=None, state=0, ask_for=None, errors=None, language=None):
+        self.model    = model
+        self.form     = form
+        self.values   = values if values is not None else {}
+        self.state    = state
+        self.ask_for  = ask_for if ask_for is not None else []
+        self.errors   = errors if errors is not None else {}
+        self.language = language
+
+    # Serialize to bytes (compact json array)
+    def to_bytes(self):
+        return json.dumps(
+            [self.model, self.form, self.values, self.state, self.ask_for, self.errors, self.language],
+            separators=(",", ":"),
+            ensure_ascii=False,
+            default=str
+        ).encode("utf-8")
+
+    # Deserialize from bytes
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(*json.loads(data))
+
+    def __repr__(self):
+        return f"FormSession({self.model}, state={self.state}, values={self.values})"
+
+
+# Form registry
+# (model and form classes by name, so that a session can be resumed from its names)
+class FormRegistry():
+
+    _models = {}
+    _forms  = {}
+    _lock   = threading.Lock()
+
+    # Register a CBaseModel subclass
+    @classmethod
+    def register_model(cls, model_class):
+        with cls._lock:
+            cls._models[registry_name(model_class)] = model_class
+
+    # Register a CForm subclass
+    @classmethod
+    def register_form(cls, form_class):
+        with cls._lock:
+            cls._forms[registry_name(form_class)] = form_class
+
+    # Get the registered model classes
+    @classmethod
+    def models(cls):
+        return list(cls._models.values())
+
+    # Get a model class by name (None if not registered)
+    @classmethod
+    def model(cls, name):
+        return cls._models.get(name)
+
+    # Get a form class by name (None if not registered)
+    @classmethod
+    def form(cls, name):
+        return cls._forms.get(name)
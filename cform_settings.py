@@ -0,0 +1,72 @@
+from cat.log import log
+from .cform_turn import TurnContext
+from .settings import MySettings
+from enum import Enum
+import functools
+import threading
+import json
+import os
+
+
+# Settings snapshot
+# (the settings file is parsed again only when its mtime or size change)
+class SettingsSnapshot():
+
+    _snapshots = {}
+    _lock = threading.Lock()
+
+    # Get the version of the settings file (None if it does not exist)
+    @classmethod
+    def version(cls, plugin):
+        path = getattr(plugin, "path", None)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(os.path.join(path, "settings.json"))
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    # Get the default settings
+    # (merged under the saved ones: a settings file saved by a previous version lacks the new settings)
+    @classmethod
+    def defaults(cls):
+        defaults = {}
+        for name, field in MySettings.model_fields.items():
+            value = field.default
+            defaults[name] = value.value if isinstance(value, Enum) else value
+        return defaults
+
+    # Get the plugin settings, reading the file only if it has changed
+    @classmethod
+    def load(cls, cat):
+        plugin  = cat.mad_hatter.get_plugin()
+        key     = getattr(plugin, "path", None) or id(plugin)
+        version = cls.version(plugin)
+
+        snapshot = cls._snapshots.get(key)
+        if snapshot and version is not None and snapshot[0] == version:
+            return snapshot[1]
+
+        with cls._lock:
+            settings = cls.defaults() | (plugin.load_settings() or {})
+            cls._snapshots[key] = (version, settings)
+            log.debug(f"Settings loaded (version: {version})")
+            return settings
+
+
+# Get the settings of the current turn
+# (the snapshot is stored in the turn context of the user message it belongs to)
+def get_settings(cat):
+    return TurnContext.current(cat).get("settings", lambda: SettingsSnapshot.load(cat))
+
+
+# Parse a json string (the parsed value is shared, it must not be modified)
+@functools.lru_cache(maxsize=64)
+def _parse_json(value):
+    return json.loads(value)
+
+
+# Get a json setting of the current turn, parsed only when its value changes
+def get_json_setting(cat, name):
+    return _parse_json(get_settings(cat)[name])
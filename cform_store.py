@@ -0,0 +1,248 @@
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+from cat.log import log
+from .cform_session import FormSession
+from .cform_settings import get_settings
+from .cform_turn import TurnContext
+import threading
+import sqlite3
+import atexit
+import time
+import os
+
+
+# Get the user id of a cat
+# (a shared fallback id would let the users read and overwrite each other's sessions)
+def get_user_id(cat):
+    user_id = getattr(cat, "user_id", None)
+    if not user_id:
+        raise ValueError("The session store needs the user id of the cat")
+    return str(user_id)
+
+
+# Session store interface
+# (keeps the form sessions of each user; a backend implements load, save and delete)
+class SessionStore(ABC):
+
+    # Get the sessions of the user (key -> FormSession, the most recently saved last)
+    @abstractmethod
+    def load(self, cat):
+        pass
+
+    # Save a session
+    @abstractmethod
+    def save(self, cat, key, session):
+        pass
+
+    # Delete a session
+    @abstractmethod
+    def delete(self, cat, key):
+        pass
+
+    # Write the pending changes
+    def flush(self):
+        pass
+
+
+# Working memory session store
+# (the sessions live in the working memory of the user, as long as the process)
+class WorkingMemorySessionStore(SessionStore):
+
+    def load(self, cat):
+        if "_active_cforms" not in cat.working_memory.keys():
+            return OrderedDict()
+        return OrderedDict(
+            (key, cat.working_memory[key]) for key in cat.working_memory["_active_cforms"] if key in cat.working_memory.keys()
+        )
+
+    def save(self, cat, key, session):
+        if "_active_cforms" not in cat.working_memory.keys():
+            cat.working_memory["_active_cforms"] = []
+        if key in cat.working_memory["_active_cforms"]:
+            cat.working_memory["_active_cforms"].remove(key)
+        cat.working_memory["_active_cforms"].append(key)
+        cat.working_memory[key] = session
+
+    def delete(self, cat, key):
+        if "_active_cforms" in cat.working_memory.keys() and key in cat.working_memory["_active_cforms"]:
+            cat.working_memory["_active_cforms"].remove(key)
+        if key in cat.working_memory.keys():
+            del cat.working_memory[key]
+
+
+# SQLite session store
+# (the sessions of a user are read with a single query; the writes are queued
+# and written in batches by a background thread)
+class SQLiteSessionStore(SessionStore):
+
+    flush_interval = 0.05
+    retry_interval = 1.0
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (user_id TEXT, key TEXT, data BLOB, updated REAL, PRIMARY KEY (user_id, key))"
+        )
+        self.connection.commit()
+
+        # Pending writes (user_id -> key -> (data, updated), data is None for a delete)
+        self.pending  = {}
+        self.lock     = threading.Lock()
+        self.db_lock  = threading.Lock()
+        self.event    = threading.Event()
+        self.closed   = False
+
+        self.writer = threading.Thread(target=self._write_behind, name="cform-sessions", daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def load(self, cat):
+        user_id = get_user_id(cat)
+        with self.db_lock:
+            rows = self.connection.execute(
+                "SELECT key, data, updated FROM sessions WHERE user_id = ?", (user_id,)
+            ).fetchall()
+            with self.lock:
+                pending = dict(self.pending.get(user_id, {}))
+
+        # The pending writes are newer than the saved rows
+        entries = {key: (data, updated) for key, data, updated in rows}
+        entries.update(pending)
+
+        sessions = OrderedDict()
+        for key, (data, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if data is not None:
+                sessions[key] = FormSession.from_bytes(data)
+        return sessions
+
+    def save(self, cat, key, session):
+        self._queue(get_user_id(cat), key, session.to_bytes())
+
+    def delete(self, cat, key):
+        self._queue(get_user_id(cat), key, None)
+
+    # Queue a write
+    def _queue(self, user_id, key, data):
+        with self.lock:
+            self.pending.setdefault(user_id, {})[key] = (data, time.time())
+        self.event.set()
+
+    # Write the pending changes in a single transaction
+    # (if the transaction fails the changes are queued again, unless a newer change of the same session is pending)
+    def flush(self):
+        with self.db_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return
+
+            upserts = []
+            deletes = []
+            for user_id, entries in pending.items():
+                for key, (data, updated) in entries.items():
+                    if data is None:
+                        deletes.append((user_id, key))
+                    else:
+                        upserts.append((user_id, key, data, updated))
+
+            try:
+                with self.connection:
+                    self.connection.executemany(
+                        "INSERT OR REPLACE INTO sessions (user_id, key, data, updated) VALUES (?, ?, ?, ?)", upserts
+                    )
+                    self.connection.executemany("DELETE FROM sessions WHERE user_id = ? AND key = ?", deletes)
+            except Exception:
+                self._requeue(pending)
+                raise
+
+    # Queue again the changes of a failed write (the newer pending changes win)
+    def _requeue(self, pending):
+        with self.lock:
+            for user_id, entries in pending.items():
+                user_pending = self.pending.setdefault(user_id, {})
+                for key, entry in entries.items():
+                    if key not in user_pending or user_pending[key][1] < entry[1]:
+                        user_pending[key] = entry
+
+    # Background writer
+    def _write_behind(self):
+        while not self.closed:
+            self.event.wait()
+            self.event.clear()
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log.error(f"Unable to write the form sessions, retrying: {e}")
+                time.sleep(self.retry_interval)
+                self.event.set()
+
+    # Write the pending changes and stop the writer
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.event.set()
+        try:
+            self.flush()
+        except Exception as e:
+            log.error(f"Unable to write the form sessions: {e}")
+
+
+# Session stores registry
+# (other backends can be added with register)
+class SessionStores():
+
+    _factories = {
+        "working memory": lambda path: WorkingMemorySessionStore(),
+        "sqlite":         lambda path: SQLiteSessionStore(path or os.path.join(os.path.dirname(__file__), "sessions.db"))
+    }
+    _stores = {}
+    _lock = threading.Lock()
+
+    # Register a session store backend (factory receives the session store path setting)
+    @classmethod
+    def register(cls, name, factory):
+        cls._factories[name] = factory
+
+    # Get the session store selected in the settings
+    @classmethod
+    def get(cls, settings):
+        name = settings.get("session_store") or "working memory"
+        path = settings.get("session_store_path") or None
+        key  = (name, path)
+
+        store = cls._stores.get(key)
+        if store is not None:
+            return store
+
+        with cls._lock:
+            if key not in cls._stores:
+                if name not in cls._factories:
+                    log.warning(f"Unknown session store {name}, using working memory")
+                log.info(f"Session store: {name} (path: {path})")
+                cls._stores[key] = cls._factories.get(name, cls._factories["working memory"])(path)
+            return cls._stores[key]
+
+    # Get the sessions of the user (read once per user message)
+    @classmethod
+    def sessions(cls, cat):
+        return TurnContext.current(cat).get("sessions", lambda: cls.get(get_settings(cat)).load(cat))
+
+    # Save a session
+    @classmethod
+    def save(cls, cat, key, session):
+        sessions = cls.sessions(cat)
+        sessions.pop(key, None)
+        sessions[key] = session
+        cls.get(get_settings(cat)).save(cat, key, session)
+
+    # Delete a session
+    @classmethod
+    def delete(cls, cat, key):
+        cls.sessions(cat).pop(key, None)
+        cls.get(get_settings(cat)).delete(cat, key)
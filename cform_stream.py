@@ -0,0 +1,25 @@
+from langchain.callbacks.base import BaseCallbackHandler
+from cat.log import log
+import inspect
+
+
+# Callback handler that forwards the LLM tokens to the user websocket
+class TokenStreamHandler(BaseCallbackHandler):
+
+    def __init__(self, cat):
+        self.cat = cat
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.cat.send_ws_message(token, "chat_token")
+
+
+# Query the LLM streaming the tokens to the user websocket, return the whole response
+def llm_stream(cat, prompt):
+
+    # The cat llm method supports streaming
+    if "stream" in inspect.signature(cat.llm).parameters:
+        return cat.llm(prompt, stream=True)
+
+    # Otherwise attach the token handler to the language model
+    log.debug("cat.llm does not support streaming, using the token stream handler")
+    return cat._llm.predict(prompt, callbacks=[TokenStreamHandler(cat)])
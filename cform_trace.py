@@ -0,0 +1,185 @@
+from cat.log import log
+import threading
+import json
+import time
+import os
+
+
+# Span that does nothing (returned when tracing is disabled)
+class NoopSpan():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+NOOP_SPAN = NoopSpan()
+
+
+# Span (a phase of a turn)
+class Span():
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer     = tracer
+        self.name       = name
+        self.parent     = parent
+        self.attributes = attributes
+        self.counters   = {}
+        self.lock       = threading.Lock()
+
+    def __enter__(self):
+        self.previous = self.tracer.current()
+        self.tracer._local.span = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        self.tracer._local.span = self.previous
+        if exc_type is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        if self.parent is not None:
+            self.parent.add(self.counters)
+        self.tracer.emit(self, duration)
+        return False
+
+    # Set attributes
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    # Add to the counters
+    def add(self, counters):
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+
+# Metrics sink (aggregates the spans by name)
+class MetricsSink():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def emit(self, record):
+        with self.lock:
+            metric = self.metrics.setdefault(record["span"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            metric["count"] += 1
+            metric["total_ms"] += record["duration_ms"]
+            metric["max_ms"] = max(metric["max_ms"], record["duration_ms"])
+            for key, value in record["counters"].items():
+                metric[key] = metric.get(key, 0) + value
+
+    # Get the aggregated metrics
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(metric, avg_ms=metric["total_ms"] / metric["count"]) for name, metric in self.metrics.items()}
+
+
+# JSON lines sink (one line for each span)
+class JsonLinesSink():
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def emit(self, record):
+        line = json.dumps(record, default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# Tracer
+# (emits a span for each phase of a turn; when disabled spans and counters cost a single check)
+class Tracer():
+
+    def __init__(self):
+        self.enabled = False
+        self.path    = None
+        self.metrics = MetricsSink()
+        self.sinks   = []
+        self._local  = threading.local()
+
+    # Enable or disable tracing from the settings
+    def configure(self, settings):
+        enabled = settings.get("trace", False) is True
+        path    = settings.get("trace_path") or None
+        if enabled == self.enabled and path == self.path:
+            return
+
+        for sink in self.sinks:
+            if isinstance(sink, JsonLinesSink):
+                sink.close()
+        self.sinks = [self.metrics]
+        if enabled and path:
+            self.sinks.append(JsonLinesSink(path))
+        self.enabled = enabled
+        self.path    = path
+        log.info(f"Tracing {'enabled' if enabled else 'disabled'} (path: {path})")
+
+    # Get the current span of this thread
+    def current(self):
+        return getattr(self._local, "span", None)
+
+    # Open a span (child of the current span of this thread)
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, self.current(), attributes)
+
+    # Add to the counters of the current span
+    def count(self, **counters):
+        if not self.enabled:
+            return
+        span = self.current()
+        if span is not None:
+            span.add(counters)
+
+    # Set attributes of the current span
+    def set(self, **attributes):
+        if not self.enabled:
+            return
+        span = self.current()
+        if span is not None:
+            span.set(**attributes)
+
+    # Run a function in another thread as a child of a span
+    def run_in(self, span, fn):
+        previous = self.current()
+        self._local.span = span
+        try:
+            return fn()
+        finally:
+            self._local.span = previous
+
+    # Send a span to the sinks
+    def emit(self, span, duration):
+        record = {
+            "span":        span.name,
+            "parent":      span.parent.name if span.parent is not None else None,
+            "timestamp":   time.time(),
+            "duration_ms": round(duration * 1000, 3),
+            "counters":    span.counters,
+            "attributes":  span.attributes
+        }
+        for sink in self.sinks:
+            try:
+                sink.emit(record)
+            except Exception as e:
+                log.error(f"Unable to emit span {span.name}: {e}")
+
+
+# Shared tracer
+tracer = Tracer()
@@ -0,0 +1,54 @@
+import threading
+
+
+# Turn context
+# (values computed once for each user message and shared by the hooks and the CForm methods)
+class TurnContext():
+
+    def __init__(self, user_message_json):
+        self.user_message_json = user_message_json
+        self.values = {}
+        self.locks  = {}
+        self.lock   = threading.Lock()
+
+    # Get a value, computing it only the first time
+    # (each key has its own lock, so different values can be computed concurrently)
+    def get(self, key, fn):
+        if key in self.values:
+            return self.values[key]
+        with self.lock:
+            key_lock = self.locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self.values:
+                self.values[key] = fn()
+        return self.values[key]
+
+    # Set a value
+    def set(self, key, value):
+        self.values[key] = value
+
+    # Remove and return a value (None if not present)
+    def pop(self, key):
+        return self.values.pop(key, None)
+
+    # Get the context of the current user message
+    # (stored in working memory, a new context is created when a new user message arrives)
+    @classmethod
+    def current(cls, cat):
+        user_message_json = cat.working_memory["user_message_json"] if "user_message_json" in cat.working_memory.keys() else None
+
+        if "_cform_turn" in cat.working_memory.keys():
+            context = cat.working_memory["_cform_turn"]
+            if context.user_message_json is user_message_json:
+                return context
+
+        context = cls(user_message_json)
+        cat.working_memory["_cform_turn"] = context
+        return context
+
+    # Drop the context of the current user message
+    # (at the end of the turn, so the embedding, the examples and the forms are not kept until the next message)
+    @classmethod
+    def end(cls, cat):
+        if "_cform_turn" in cat.working_memory.keys():
+            del cat.working_memory["_cform_turn"]
@@ -0,0 +1,109 @@
+from pydantic import ValidationError
+from collections import OrderedDict
+from .cform_trace import tracer
+import threading
+import json
+
+
+# Get the hashable key of a value
+def value_key(value):
+    try:
+        return json.dumps(value, sort_keys=True, default=str)
+    except (TypeError, ValueError):
+        return repr(value)
+
+
+# Get the error key of a pydantic error (the field name, "model" for the model validators)
+def error_key(error):
+    return ".".join(str(part) for part in error["loc"]) or "model"
+
+
+# Field validator
+# (validates only the fields changed by a merge and the fields that depend on them,
+# memoizing the outcome of each field for its value and the values of the fields it depends on)
+class FieldValidator():
+
+    max_size = 4096
+
+    def __init__(self, model_class):
+        self.model_class     = model_class
+        self.fields          = list(model_class.model_fields.keys())
+        self.required_fields = [key for key, value in model_class.model_fields.items() if value.is_required()]
+
+        # Fields to validate again when a field changes, and its inverse
+        self.dependents = {key: list(value) for key, value in getattr(model_class, "field_dependencies", {}).items()}
+        self.depends_on = {}
+        for field, dependents in self.dependents.items():
+            for dependent in dependents:
+                self.depends_on.setdefault(dependent, []).append(field)
+
+        # The model validators need the whole model
+        self.has_model_validators = bool(model_class.__pydantic_decorators__.model_validators)
+
+        self.cache = OrderedDict()
+        self.lock  = threading.Lock()
+
+    # Get the changed fields and the fields that depend on them
+    def affected(self, dirty_fields):
+        affected = []
+        pending  = list(dirty_fields)
+        while pending:
+            field = pending.pop(0)
+            if field in affected:
+                continue
+            affected.append(field)
+            pending.extend(self.dependents.get(field, []))
+        return affected
+
+    # Validate a field of the values (return the error message, None if valid)
+    def validate_field(self, values, field):
+        key = (field, value_key(values[field]), tuple(value_key(values.get(other)) for other in self.depends_on.get(field, [])))
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                tracer.count(validation_cache_hits=1)
+                return self.cache[key]
+
+        tracer.count(validated_fields=1)
+        try:
+            instance = self.model_class.model_construct(**values)
+            self.model_class.__pydantic_validator__.validate_assignment(instance, field, values[field])
+            error = None
+        except ValidationError as e:
+            error = ", ".join(error_message["msg"] for error_message in e.errors())
+
+        with self.lock:
+            self.cache[key] = error
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return error
+
+    # Validate the values
+    # (dirty_fields None validates every field present; return ask_for, errors by field and validity)
+    def validate(self, values, dirty_fields=None):
+        ask_for = [field for field in self.required_fields if values.get(field) is None]
+
+        fields = list(values.keys()) if dirty_fields is None else self.affected(dirty_fields)
+        errors = {}
+        for field in fields:
+            if field in self.model_class.model_fields and values.get(field) is not None:
+                error = self.validate_field(values, field)
+                if error is not None:
+                    errors[field] = error
+
+        if ask_for or errors:
+            return ask_for, errors, False
+
+        # The complete model is validated once, if it has model validators
+        if self.has_model_validators:
+            try:
+                self.model_class.model_validate(values)
+            except ValidationError as e:
+                for error_message in e.errors():
+                    if error_message["type"] == "missing":
+                        ask_for.append(error_message["loc"][0])
+                    else:
+                        errors[error_key(error_message)] = error_message["msg"]
+                return ask_for, errors, False
+
+        return ask_for, errors, True
@@ -7,16 +7,30 @@ class JsonExtractorType(Enum):
     b: str  = 'kor'
     c: str  = 'guardrails'
     d: str  = 'from examples'
+    e: str  = 'fused'
+    f: str  = 'field examples'
     
 class MySettings(BaseModel):
     json_extractor: JsonExtractorType = Field(
         title="json extractor",
         default="guardrails"
     )
+    field_examples_threshold: float = Field(
+        title="field examples similarity threshold",
+        default=0.8
+    )
     strict: bool = Field(
         title="strict",
         default=False
     )
+    parallel_checks: bool = Field(
+        title="run exit check, extraction and confirm check concurrently",
+        default=True
+    )
+    stream_response: bool = Field(
+        title="stream the form replies (strict mode)",
+        default=True
+    )
     ask_confirm: bool = Field(
         title="ask confirm",
         default=True
@@ -25,6 +39,27 @@ class MySettings(BaseModel):
         title="use rag for confirm",
         default=False
     )
+    rag_confirm_k: int = Field(
+        title="rag confirm: number of nearest examples that vote",
+        default=3
+    )
+    rag_confirm_threshold: float = Field(
+        title="rag confirm: minimum similarity of the voting examples",
+        default=0.0
+    )
+    rag_exit_k: int = Field(
+        title="exit intent: number of nearest examples that vote",
+        default=3
+    )
+    rag_exit_threshold: float = Field(
+        title="exit intent: minimum similarity of the voting examples",
+        default=0.9
+    )
+    confirm_lexicon: str = Field(
+        title="confirm lexicon extension (json, for each language: yes, no, negations, contrast, fillers)",
+        default="{}",
+        extra={"type": "TextArea"}
+    )
     pizza_order_examples: str = Field(
         title="pizza order examples",
         default="[]",
@@ -35,11 +70,83 @@ class MySettings(BaseModel):
         default="[]",
         extra={"type": "TextArea"}
     )
+    examples_index_path: str = Field(
+        title="examples index path (empty for memory only)",
+        default=""
+    )
     auto_handle_conversation: bool = Field(
         title="auto handle conversation",
         default=True
     )
-    
+    use_fast_router: bool = Field(
+        title="start and stop the forms with the fast router",
+        default=False
+    )
+    router_start_threshold: float = Field(
+        title="fast router start similarity threshold",
+        default=0.85
+    )
+    router_stop_threshold: float = Field(
+        title="fast router stop similarity threshold",
+        default=0.85
+    )
+    prompt_token_budget: int = Field(
+        title="prompt token budget (0 for no limit, the few-shot examples are trimmed first)",
+        default=0
+    )
+    batch_extraction: bool = Field(
+        title="batch the extraction LLM calls of the concurrent sessions",
+        default=False
+    )
+    batch_max_wait_ms: float = Field(
+        title="batch extraction: max wait for the other sessions (milliseconds)",
+        default=10
+    )
+    batch_max_size: int = Field(
+        title="batch extraction: max prompts for each request",
+        default=16
+    )
+    language_confidence_threshold: float = Field(
+        title="language detection confidence (below it the LLM is asked)",
+        default=0.8
+    )
+    result_cache_size: int = Field(
+        title="classification result cache size (for each kind)",
+        default=4096
+    )
+    result_cache_ttl: float = Field(
+        title="classification result cache ttl (seconds)",
+        default=86400
+    )
+    result_cache_threshold: float = Field(
+        title="classification result cache similarity threshold",
+        default=0.95
+    )
+    embedding_cache_size: int = Field(
+        title="embedding cache size",
+        default=4096
+    )
+    embedding_cache_path: str = Field(
+        title="embedding cache path (empty for memory only)",
+        default=""
+    )
+    session_store: str = Field(
+        title="session store (working memory, sqlite)",
+        default="working memory"
+    )
+    session_store_path: str = Field(
+        title="session store path (empty for the plugin folder)",
+        default=""
+    )
+    trace: bool = Field(
+        title="trace the turn phases",
+        default=False
+    )
+    trace_path: str = Field(
+        title="trace path (json lines, empty for metrics only)",
+        default=""
+    )
+
 @plugin
 def settings_schema():
     return MySettings.schema()